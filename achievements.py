@@ -0,0 +1,123 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+
+from ledger import SOURCE_ACHIEVEMENT, record_many
+
+
+# ==================== РЕЕСТР ДОСТИЖЕНИЙ ====================
+@dataclass(frozen=True)
+class Achievement:
+    # bit — позиция в users.achievements_mask; биты не переиспользуются,
+    # новые достижения добавляются только в конец
+    bit: int
+    name: str
+    description: str
+    stat: str
+    threshold: int
+    hp: int = 0
+    bronze: int = 0
+    silver: int = 0
+    gold: int = 0
+
+    @property
+    def flag(self):
+        return 1 << self.bit
+
+
+ACHIEVEMENTS = (
+    Achievement(0, "💪 Новичок", "Выполнить первую задачу", "total_tasks", 1, 50, 5, 0, 0),
+    Achievement(1, "🔥 Труженик", "Выполнить 10 задач", "total_tasks", 10, 100, 10, 5, 0),
+    Achievement(2, "🏆 Мастер", "Выполнить 50 задач", "total_tasks", 50, 300, 20, 10, 5),
+    Achievement(3, "⭐️ Легенда", "Выполнить 100 задач", "total_tasks", 100, 500, 50, 25, 10),
+    Achievement(4, "📈 Уровень 5", "Достичь 5 уровня", "level", 5, 100, 10, 5, 1),
+    Achievement(5, "📈 Уровень 10", "Достичь 10 уровня", "level", 10, 200, 20, 10, 3),
+    Achievement(6, "❤️ 1000 HP", "Накопить 1000 опыта", "hp", 1000, 300, 30, 15, 5),
+)
+
+STATS = ("total_tasks", "level", "hp")
+BY_NAME = {a.name: a for a in ACHIEVEMENTS}
+
+
+def _build_index():
+    # stat -> (отсортированные пороги, достижения в том же порядке)
+    index = {}
+    for stat in STATS:
+        items = sorted((a for a in ACHIEVEMENTS if a.stat == stat), key=lambda a: a.threshold)
+        index[stat] = ([a.threshold for a in items], items)
+    return index
+
+
+_INDEX = _build_index()
+
+
+def crossed(stat, old, new):
+    # Достижения, чей порог лежит в полуинтервале (old, new]
+    if new <= old:
+        return []
+    thresholds, items = _INDEX[stat]
+    return items[bisect_right(thresholds, old):bisect_right(thresholds, new)]
+
+
+def mask_count(mask):
+    return bin(mask).count("1")
+
+
+def evaluate(before, after, mask):
+    # before/after — словари значений STATS до и после изменения.
+    # Награда за достижение сама добавляет HP и может пересечь следующий
+    # порог по HP, поэтому досчитываем каскад до неподвижной точки.
+    earned = []
+    for stat in STATS:
+        for a in crossed(stat, before[stat], after[stat]):
+            if not mask & a.flag:
+                earned.append(a)
+                mask |= a.flag
+
+    pending = earned
+    hp = after["hp"]
+    while pending:
+        gain = sum(a.hp for a in pending)
+        pending = [a for a in crossed("hp", hp, hp + gain) if not mask & a.flag]
+        for a in pending:
+            mask |= a.flag
+        earned.extend(pending)
+        hp += gain
+    return earned
+
+
+async def grant(conn, user_id, before, after, mask):
+    # Выполняется внутри операции записи, уже обновившей users:
+    # все выдачи — одна многострочная вставка и один UPDATE наград
+    earned = evaluate(before, after, mask)
+    if not earned:
+        return []
+
+    achieved_date = datetime.now().isoformat()
+    placeholders = ", ".join(["(?, ?, ?)"] * len(earned))
+    params = []
+    for a in earned:
+        params += [user_id, a.name, achieved_date]
+    await conn.execute(
+        f"INSERT OR IGNORE INTO achievements (user_id, achievement_name, achieved_date) VALUES {placeholders}",
+        params
+    )
+
+    flags = 0
+    for a in earned:
+        flags |= a.flag
+    await conn.execute(
+        "UPDATE users SET hp = hp + ?, bronze = bronze + ?, silver = silver + ?, gold = gold + ?, achievements_mask = achievements_mask | ? WHERE user_id = ?",
+        (
+            sum(a.hp for a in earned),
+            sum(a.bronze for a in earned),
+            sum(a.silver for a in earned),
+            sum(a.gold for a in earned),
+            flags,
+            user_id,
+        )
+    )
+    await record_many(conn, user_id, [
+        (SOURCE_ACHIEVEMENT, a.name, (a.hp, a.bronze, a.silver, a.gold)) for a in earned
+    ])
+    return earned
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+import random
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from clock import clock
+from daily import current_streak
+from db import db
+from quests import QUESTS_PER_DAY
+
+# ========== НАСТРОЙКИ ==========
+ADVICE_CACHE_SIZE = int(os.getenv("ADVICE_CACHE_SIZE", "10000"))
+# Пауза перед пересчётом: серия изменений одного пользователя — один пересчёт
+ADVICE_DEBOUNCE = float(os.getenv("ADVICE_DEBOUNCE", "1.0"))
+# При старте заранее считаются советы тех, кто был активен за эти дни
+ADVICE_WARM_DAYS = int(os.getenv("ADVICE_WARM_DAYS", "2"))
+# Сколько лучших советов показывать по кругу при повторных нажатиях
+ADVICE_TOP = 3
+# Окна истории для долей сложностей и доли выполненных квестов
+MIX_DAYS = 30
+QUEST_RATE_DAYS = 7
+STALE_GOAL_DAYS = 7
+MANY_GOALS = 10
+
+GENERIC = (
+    "💪 Маленькие шаги каждый день приводят к большим результатам!",
+    "🎯 Разбей большую цель на маленькие задачи — так легче начать.",
+    "🌟 Каждая выполненная цель делает тебя сильнее!",
+    "📚 Учись новому каждый день — это прокачивает мозг.",
+    "⚡️ Самое сложное — начать. Сделай первый шаг прямо сейчас!",
+    "🎮 Отдых тоже важен. Не забывай про перерывы.",
+    "🌈 Верь в себя — у тебя всё получится!",
+)
+
+log = logging.getLogger(__name__)
+
+
+def _md(text):
+    # Названия целей вставляются в ответ с parse_mode="Markdown"
+    return re.sub(r"([_*`\[])", r"\\\1", text)
+
+
+def _days(n):
+    if 11 <= n % 100 <= 14:
+        return f"{n} дней"
+    if n % 10 == 1:
+        return f"{n} день"
+    if 2 <= n % 10 <= 4:
+        return f"{n} дня"
+    return f"{n} дней"
+
+
+# ==================== ПРИЗНАКИ ====================
+class Profile:
+    # Всё, на что смотрят правила: читается несколькими запросами по ключу
+    __slots__ = (
+        "total_tasks", "open_goals", "oldest_goal", "easiest_goal",
+        "streak", "done_today", "last_active", "mix", "quest_rate", "quests_left",
+    )
+
+
+async def load_profile(user_id, today, database=db):
+    p = Profile()
+    row = await database.fetchone(
+        "SELECT total_tasks, streak, last_daily FROM users WHERE user_id = ?", (user_id,)
+    )
+    if row is None:
+        return None
+    p.total_tasks = row[0] or 0
+    # Серию ведёт daily.py; last_daily — последний активный день по часам пользователя
+    p.streak = current_streak(row[1], row[2], today)
+    p.done_today = row[2] == today.isoformat()
+    p.last_active = datetime.fromisoformat(row[2]).date() if row[2] else None
+
+    row = await database.fetchone("SELECT COUNT(*) FROM tasks WHERE user_id = ? AND completed = 0", (user_id,))
+    p.open_goals = row[0]
+    # Самая старая и самая лёгкая из открытых — по частичному индексу
+    p.oldest_goal = await database.fetchone(
+        "SELECT title, created_at FROM tasks WHERE user_id = ? AND completed = 0 ORDER BY id LIMIT 1", (user_id,)
+    )
+    if p.oldest_goal and p.oldest_goal[1]:
+        # Возраст цели считается в днях пользователя, как и today
+        p.oldest_goal = (p.oldest_goal[0], clock.date_of(user_id, p.oldest_goal[1]))
+    p.easiest_goal = await database.fetchone(
+        "SELECT title FROM tasks WHERE user_id = ? AND completed = 0 ORDER BY CAST(difficulty AS INTEGER), id LIMIT 1",
+        (user_id,)
+    )
+
+    mix_since = (today - timedelta(days=MIX_DAYS)).isoformat()
+    rows = await database.fetchall(
+        "SELECT day, tasks_easy, tasks_medium, tasks_hard, quests FROM daily_stats WHERE user_id = ? AND day >= ?",
+        (user_id, mix_since)
+    )
+    p.mix = [0, 0, 0]
+    quests_done = 0
+    quest_since = (today - timedelta(days=QUEST_RATE_DAYS)).isoformat()
+    for stat_day, easy, medium, hard, quests in rows:
+        p.mix = [p.mix[0] + easy, p.mix[1] + medium, p.mix[2] + hard]
+        if quest_since <= stat_day < today.isoformat():
+            quests_done += quests
+    p.quest_rate = quests_done / (QUESTS_PER_DAY * QUEST_RATE_DAYS)
+
+    row = await database.fetchone(
+        "SELECT COUNT(*) - COALESCE(SUM(completed), 0) FROM daily_quests WHERE user_id = ? AND date = ?",
+        (user_id, today.isoformat())
+    )
+    p.quests_left = row[0]
+    return p
+
+
+# ==================== ПРАВИЛА ====================
+def score(p, today):
+    # [(вес, текст), ...] — чем выше вес, тем уместнее совет сейчас
+    out = []
+    if p.total_tasks == 0 and p.open_goals == 0:
+        out.append((100, "🌟 Начни игру! Добавь первую цель — лучше лёгкую, на сегодня."))
+    elif p.open_goals == 0:
+        out.append((80, "📝 Все цели выполнены! Добавь новую, пока есть настрой."))
+
+    if p.streak >= 2 and not p.done_today:
+        out.append((90, f"🔥 Серия {_days(p.streak)} подряд! Выполни сегодня хотя бы одну цель, чтобы её не прервать."))
+    elif p.streak >= 3:
+        out.append((35, f"🔥 Ты в деле уже {_days(p.streak)} подряд — так держать!"))
+
+    if p.last_active is not None and (today - p.last_active).days > 2 and p.easiest_goal:
+        out.append((75, f"👋 Давно не виделись! Начни с простого: «{_md(p.easiest_goal[0])}»."))
+
+    if p.oldest_goal and p.oldest_goal[1]:
+        age = (today - p.oldest_goal[1]).days
+        if age >= STALE_GOAL_DAYS:
+            out.append((60, f"⏳ Цель «{_md(p.oldest_goal[0])}» ждёт уже {_days(age)}. Разбей её на шаги поменьше или удали."))
+
+    if p.open_goals > MANY_GOALS:
+        out.append((50, f"🎯 Открытых целей: {p.open_goals}. Выбери три главные на сегодня — остальные подождут."))
+
+    done = sum(p.mix)
+    if done >= 5:
+        easy, _, hard = (n / done for n in p.mix)
+        if easy >= 0.7:
+            out.append((55, "⚔️ Почти все твои цели лёгкие. Попробуй сложную — за неё дают 30 HP и золото."))
+        elif hard >= 0.6:
+            out.append((40, "🌱 Ты берёшься в основном за сложное. Добавь пару лёгких целей для ритма."))
+
+    if p.quests_left:
+        weight = 65 if p.quest_rate < 0.5 else 30
+        out.append((weight, f"📋 На сегодня осталось квестов: {p.quests_left}. Это быстрые монеты!"))
+    elif p.quest_rate >= 0.8:
+        out.append((25, "📋 Ты закрываешь почти все ежедневные квесты — отличная дисциплина!"))
+
+    if p.total_tasks:
+        out.append((15, f"🏆 Ты уже выполнил {p.total_tasks} задач! Так держать!"))
+    out.append((10, random.choice(GENERIC)))
+    out.sort(key=lambda item: -item[0])
+    return [text for _, text in out[:ADVICE_TOP]]
+
+
+# ==================== ФОНОВЫЙ РАСЧЁТ ====================
+class Advisor:
+    # Советы считаются заранее: изменения состояния помечают пользователя
+    # через mark(), фоновый run() пересчитывает помеченных. Кнопка читает
+    # готовый список из кэша; кэш помнит день расчёта, так что серии и
+    # квесты не устаревают за полночь. Промах (пользователь не помечен с
+    # момента старта) ждёт один общий расчёт.
+
+    def __init__(self, database=db, max_size=ADVICE_CACHE_SIZE):
+        self.db = database
+        self.max_size = max_size
+        self._advice = OrderedDict()
+        self._dirty = set()
+        self._wakeup = asyncio.Event()
+        self._inflight = {}
+        self.computed = 0
+        # (index, count) в шардированном режиме: прогреваются только свои
+        self.shard = None
+
+    def __len__(self):
+        return len(self._advice)
+
+    def mark(self, user_id):
+        self._dirty.add(user_id)
+        self._wakeup.set()
+
+    async def get(self, user_id):
+        today = clock.today(user_id)
+        entry = self._advice.get(user_id)
+        if entry is None or entry[0] != today:
+            entry = await self._compute_once(user_id)
+            if entry is None:
+                return None
+        self._advice.move_to_end(user_id)
+        day, texts, shown = entry
+        # Повторные нажатия показывают следующий из лучших советов
+        self._advice[user_id] = (day, texts, shown + 1)
+        return texts[shown % len(texts)]
+
+    async def _compute_once(self, user_id):
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def _compute(self, user_id):
+        today = clock.today(user_id)
+        profile = await load_profile(user_id, today, self.db)
+        if profile is None:
+            self._advice.pop(user_id, None)
+            return None
+        old = self._advice.get(user_id)
+        entry = (today, score(profile, today), old[2] if old else 0)
+        self._advice[user_id] = entry
+        self._advice.move_to_end(user_id)
+        while len(self._advice) > self.max_size:
+            self._advice.popitem(last=False)
+        self.computed += 1
+        return entry
+
+    async def warm(self):
+        since = (datetime.now().date() - timedelta(days=ADVICE_WARM_DAYS)).isoformat()
+        rows = await self.db.fetchall(
+            "SELECT DISTINCT user_id FROM daily_stats WHERE day >= ? LIMIT ?", (since, self.max_size)
+        )
+        for (user_id,) in rows:
+            if self.shard and user_id % self.shard[1] != self.shard[0]:
+                continue
+            self.mark(user_id)
+
+    async def run(self):
+        try:
+            await self.warm()
+        except Exception:
+            log.exception("Не удалось выбрать пользователей для прогрева советов")
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(ADVICE_DEBOUNCE)
+            self._wakeup.clear()
+            batch, self._dirty = self._dirty, set()
+            for user_id in batch:
+                try:
+                    await self._compute_once(user_id)
+                except Exception:
+                    log.exception("Не удалось пересчитать советы для %s", user_id)
+
+
+advisor = Advisor()
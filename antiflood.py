@@ -0,0 +1,106 @@
+import os
+import time
+from collections import Counter
+
+from aiogram import BaseMiddleware
+
+from sender import PRIORITY_INTERACTIVE, TokenBucket, post
+
+# ========== НАСТРОЙКИ ==========
+# Обновлений в секунду от одного пользователя и допустимый всплеск;
+# FLOOD_RATE = 0 — без ограничения
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "2"))
+FLOOD_BURST = int(os.getenv("FLOOD_BURST", "8"))
+# Сколько секунд после обработки повторное нажатие той же кнопки того же
+# сообщения считается дублем
+CALLBACK_DEDUP_SECONDS = float(os.getenv("CALLBACK_DEDUP_SECONDS", "1.5"))
+# Как часто вычищать вёдра и отметки простаивающих пользователей (секунды)
+FLOOD_SWEEP_INTERVAL = 60.0
+
+
+# ==================== MIDDLEWARE ====================
+class AntiFloodMiddleware(BaseMiddleware):
+    # Outer-middleware на update, регистрируется до FSM-middleware (см.
+    # bot.py): лишнее обновление отбрасывается до замка пользователя и до
+    # чтения состояния из базы.
+    # Нажатие кнопки считается дублем, пока такое же (пользователь,
+    # сообщение, callback_data) обрабатывается или обработано меньше
+    # CALLBACK_DEDUP_SECONDS назад. Отброшенный callback всё равно получает
+    # пустой ответ в фоне, чтобы у кнопки пропали «часики».
+
+    def __init__(self, rate=FLOOD_RATE, burst=FLOOD_BURST, dedup_seconds=CALLBACK_DEDUP_SECONDS):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_seconds = dedup_seconds
+        self._buckets = {}
+        # ключ нажатия -> None, пока обрабатывается, иначе время окончания
+        self._presses = {}
+        self._swept = time.monotonic()
+        self.dropped = Counter()
+
+    def _press_key(self, user_id, callback):
+        if callback.message is not None:
+            return user_id, callback.message.chat.id, callback.message.message_id, callback.data
+        return user_id, callback.inline_message_id, None, callback.data
+
+    def _allow(self, user_id, now):
+        if not self.rate:
+            return True
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        if bucket.delay(now) > 0:
+            return False
+        bucket.take(now)
+        return True
+
+    def _sweep(self, now):
+        # Полное ведро ничем не отличается от нового — его можно забыть
+        self._buckets = {
+            user_id: bucket for user_id, bucket in self._buckets.items()
+            if bucket.tokens + (now - bucket.updated) * bucket.rate < bucket.capacity
+        }
+        self._presses = {
+            key: finished for key, finished in self._presses.items()
+            if finished is None or now - finished < self.dedup_seconds
+        }
+        self._swept = now
+
+    def _drop(self, event, reason):
+        self.dropped[reason] += 1
+        if event.callback_query is not None:
+            post(event.callback_query.answer(), priority=PRIORITY_INTERACTIVE)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        if now - self._swept > FLOOD_SWEEP_INTERVAL:
+            self._sweep(now)
+
+        callback = event.callback_query
+        key = None
+        if callback is not None and callback.data:
+            key = self._press_key(user.id, callback)
+            if key in self._presses:
+                finished = self._presses[key]
+                if finished is None or now - finished < self.dedup_seconds:
+                    self._drop(event, "duplicate")
+                    return None
+
+        if not self._allow(user.id, now):
+            self._drop(event, "rate")
+            return None
+
+        if key is None:
+            return await handler(event, data)
+        self._presses[key] = None
+        try:
+            return await handler(event, data)
+        finally:
+            self._presses[key] = time.monotonic()
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,340 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from datetime import datetime
+
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+
+# Нагрузочный прогон бота без сети: синтетические обновления идут в
+# dp.feed_update, ответы Telegram подделывает FakeSession.
+#
+#   python bench.py --users 2000 --concurrency 200 --json after.json --baseline before.json
+#
+# Настройки модулей бота читаются при импорте, поэтому они импортируются
+# только после разбора аргументов и подготовки окружения (см. main).
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон LifeRPG-бота без Telegram")
+    parser.add_argument("--users", type=int, default=1000, help="число симулируемых пользователей")
+    parser.add_argument("--sessions", type=int, default=3, help="сессий на пользователя")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Telegram, мс")
+    parser.add_argument("--db", default=None, help="файл базы (по умолчанию временный)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="сохранить результат в файл")
+    parser.add_argument("--baseline", default=None, help="сравнить с ранее сохранённым результатом")
+    return parser.parse_args()
+
+
+# ==================== ЗАМЕРЫ ====================
+class Sample:
+    # Одно обновление: какой хендлер его обработал и сколько ждали базу
+    __slots__ = ("handler", "db_time")
+
+    def __init__(self):
+        self.handler = "(не обработано)"
+        self.db_time = 0.0
+
+
+current = ContextVar("current", default=None)
+
+
+class Stats:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.db_time = defaultdict(float)
+        self.api_calls = Counter()
+        self.errors = 0
+        self.updates = 0
+        self.elapsed = 0.0
+
+    def add(self, sample, latency):
+        self.updates += 1
+        self.latency[sample.handler].append(latency)
+        self.db_time[sample.handler] += sample.db_time
+
+    def report(self):
+        rows = {}
+        for handler, values in self.latency.items():
+            values.sort()
+            rows[handler] = {
+                "count": len(values),
+                "p50": percentile(values, 50) * 1000,
+                "p95": percentile(values, 95) * 1000,
+                "p99": percentile(values, 99) * 1000,
+                "db": self.db_time[handler] / len(values) * 1000,
+            }
+        return {
+            "updates": self.updates,
+            "elapsed": self.elapsed,
+            "throughput": self.updates / self.elapsed if self.elapsed else 0.0,
+            "errors": self.errors,
+            "api_calls": dict(self.api_calls),
+            "handlers": rows,
+        }
+
+
+def percentile(values, p):
+    # values отсортирован; ближайший ранг
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def instrument_db(database):
+    # Время в базе с точки зрения хендлера: чтения (включая ожидание
+    # свободного читателя) и записи (включая окно групповой фиксации)
+    reader = database.reader
+    run = database.run
+
+    class TimedReader:
+        def __init__(self):
+            self._cm = reader()
+
+        async def __aenter__(self):
+            self._started = time.perf_counter()
+            return await self._cm.__aenter__()
+
+        async def __aexit__(self, *exc):
+            try:
+                return await self._cm.__aexit__(*exc)
+            finally:
+                sample = current.get()
+                if sample is not None:
+                    sample.db_time += time.perf_counter() - self._started
+
+    async def timed_run(op):
+        started = time.perf_counter()
+        try:
+            return await run(op)
+        finally:
+            sample = current.get()
+            if sample is not None:
+                sample.db_time += time.perf_counter() - started
+
+    database.reader = TimedReader
+    database.run = timed_run
+
+
+# ==================== ПОДДЕЛЬНЫЙ TELEGRAM ====================
+class FakeSession(BaseSession):
+    # Отвечает на любой метод правдоподобным результатом и запоминает
+    # последнюю inline-клавиатуру в каждом чате — по ней симулируемый
+    # пользователь «нажимает» кнопки
+    def __init__(self, stats, latency=0.0):
+        super().__init__()
+        self.stats = stats
+        self.latency = latency
+        self.keyboards = {}
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        self.stats.api_calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = getattr(method, "chat_id", None)
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(chat_id, int) and isinstance(markup, types.InlineKeyboardMarkup):
+            self.keyboards[chat_id] = [b.callback_data for row in markup.inline_keyboard for b in row]
+
+        returning = method.__returning__
+        if returning is bool:
+            return True
+        if returning is types.Message or "Message" in str(returning):
+            return types.Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=types.Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+
+# ==================== СЦЕНАРИИ ====================
+class User:
+    def __init__(self, user_id, rng):
+        self.id = user_id
+        self.rng = rng
+        self.tg_user = None
+
+    def message(self, ids, text):
+        chat = types.Chat(id=self.id, type="private")
+        return types.Update(update_id=next(ids), message=types.Message(
+            message_id=next(ids), date=datetime.now(), chat=chat, from_user=self.tg_user, text=text,
+        ))
+
+    def callback(self, ids, data):
+        chat = types.Chat(id=self.id, type="private")
+        return types.Update(update_id=next(ids), callback_query=types.CallbackQuery(
+            id=str(next(ids)), chat_instance=str(self.id), from_user=self.tg_user, data=data,
+            message=types.Message(message_id=next(ids), date=datetime.now(), chat=chat, text="…"),
+        ))
+
+
+GOAL_TITLES = ("Прочитать главу", "Пробежка", "Домашка", "Уборка", "Английский", "Курсы", "Зарядка")
+
+
+def session_script(user, first):
+    # Шаги одной сессии: ("msg", текст) или ("click", префикс callback_data)
+    rng = user.rng
+    steps = [("msg", "/start")] if first else []
+    steps.append(("msg", rng.choice(["👤 Профиль", "🏆 Достижения", "🏅 Рейтинг"])))
+    steps.append(("msg", "🎮 Игра"))
+    for _ in range(rng.randint(1, 3)):
+        steps.append(("msg", "➕ Добавить цель"))
+        title = rng.choice(GOAL_TITLES)
+        if rng.random() < 0.5:
+            steps.append(("msg", f"{title} | {rng.randint(1, 3)}"))
+        else:
+            steps.append(("msg", title))
+            steps.append(("click", "goal_diff_"))
+    steps.append(("msg", "📋 Мои цели"))
+    steps.append(("msg", "✅ Выполнить цель"))
+    steps.append(("click", "complete_"))
+    steps.append(("msg", "◀️ Назад"))
+    steps.append(("msg", "📋 Квесты"))
+    steps.append(("click", "quest_"))
+    if rng.random() < 0.3:
+        steps.append(("msg", "🛒 Магазин"))
+        steps.append(("click", "buy_"))
+    steps.append(("msg", rng.choice(["👤 Профиль", "🤖 AI Помощник"])))
+    return steps
+
+
+async def run_user(user, sessions, feed, keyboards, ids):
+    user.tg_user = types.User(id=user.id, is_bot=False, first_name=f"user{user.id}")
+    for number in range(sessions):
+        for kind, value in session_script(user, number == 0):
+            if kind == "msg":
+                await feed(user.message(ids, value))
+                continue
+            options = [data for data in keyboards.get(user.id, ()) if data and data.startswith(value)]
+            if options:
+                await feed(user.callback(ids, user.rng.choice(options)))
+
+
+# ==================== ЗАПУСК ====================
+def print_report(result, baseline=None):
+    print(f"\nОбновлений: {result['updates']} за {result['elapsed']:.1f} с — {result['throughput']:.0f} обн./с, ошибок: {result['errors']}")
+    print(f"\n{'хендлер':<30}{'кол-во':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'база мс':>10}")
+    for handler, row in sorted(result["handlers"].items(), key=lambda item: -item[1]["count"]):
+        line = f"{handler:<30}{row['count']:>8}{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}{row['db']:>10.2f}"
+        old = (baseline or {}).get("handlers", {}).get(handler)
+        if old and old["p95"]:
+            line += f"   p95 {(row['p95'] / old['p95'] - 1) * 100:+.0f}%"
+        print(line)
+    if baseline:
+        print(f"\nБазовая пропускная способность: {baseline['throughput']:.0f} обн./с "
+              f"({(result['throughput'] / baseline['throughput'] - 1) * 100:+.0f}%)")
+    print("\nВызовы API:", ", ".join(f"{name}={count}" for name, count in sorted(result["api_calls"].items())))
+
+
+async def bench(args):
+    import bot as app
+    from leaderboard import leaderboard
+    from migrations import migrate
+    from sender import drain_posts
+
+    # Строка лога на каждое обновление исказила бы замеры
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stats = Stats()
+    session = FakeSession(stats, args.api_latency / 1000)
+    session.middleware = app.bot.session.middleware
+    app.bot.session = session
+    instrument_db(app.db)
+
+    async def name_handler(handler, event, data):
+        sample = current.get()
+        if sample is not None:
+            sample.handler = data["handler"].callback.__name__
+        return await handler(event, data)
+
+    app.dp.message.middleware(name_handler)
+    app.dp.callback_query.middleware(name_handler)
+
+    async def feed(update):
+        sample = Sample()
+        current.set(sample)
+        started = time.perf_counter()
+        try:
+            await app.dp.feed_update(app.bot, update)
+        except Exception:
+            stats.errors += 1
+        stats.add(sample, time.perf_counter() - started)
+
+    await app.db.open()
+    try:
+        await migrate()
+        await leaderboard.load()
+
+        rng = random.Random(args.seed)
+        users = [User(10_000_000 + i, random.Random(rng.random())) for i in range(args.users)]
+        ids = itertools.count(1)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(user):
+            async with semaphore:
+                await run_user(user, args.sessions, feed, session.keyboards, ids)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(user) for user in users))
+        stats.elapsed = time.perf_counter() - started
+    finally:
+        await drain_posts()
+        await app.limiter.close()
+        await app.dp.storage.close()
+        await app.db.close()
+    return stats.report()
+
+
+def main():
+    args = parse_args()
+    workdir = None
+    if args.db is None:
+        workdir = tempfile.TemporaryDirectory()
+        args.db = os.path.join(workdir.name, "bench.db")
+    os.environ["DB_PATH"] = args.db
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+    # Ограничитель отправки мерил бы лимиты Telegram, а не бота
+    os.environ.setdefault("SEND_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("SEND_CHAT_RATE", "1000000")
+    os.environ.setdefault("SEND_CHAT_BURST", "1000")
+    # Симулируемые пользователи жмут быстрее живых — антифлуд бы их резал
+    os.environ.setdefault("FLOOD_RATE", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    result = asyncio.run(bench(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if workdir is not None:
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
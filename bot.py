@@ -1,78 +1,82 @@
 import asyncio
 import logging
-import random
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-import aiosqlite
 import os
 
+from achievements import grant, mask_count
+from advisor import advisor
+from antiflood import AntiFloodMiddleware
+from cache import user_cache
+from clock import clock, is_valid_zone
+from daily import current_streak, end_of_day_loop, touch_streak
+from db import db
+from leaderboard import leaderboard
+from ledger import SOURCE_PURCHASE, SOURCE_QUEST, SOURCE_TASK, SOURCE_TITLES, history, record, snapshot_loop
+from locks import UserEventIsolation
+from maintenance import maintenance_loop
+from metrics import METRICS_PORT, ApiMetricsMiddleware, instrument_database, instrument_dispatcher, metrics, serve_metrics
+from migrations import migrate
+from quests import generate_for_users
+from scheduler import ReminderScheduler, parse_weekdays, weekdays_text, EVERY_DAY
+from stats import add_daily, daily_range, monthly
+from storage import SQLiteStorage
+from sender import CallbackReply, RateLimiter, RateLimitMiddleware, drain_posts, post
+from sharding import WORKERS, OrderedFeeder, consume, ignore_interrupts, run_front
+from webhook import run_webhook
+
 # ========== НАСТРОЙКИ ==========
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 YOUR_USER_ID = 1484297802  # ← ТВОЙ ID
+# polling — опрос getUpdates, webhook — HTTP-сервер (см. webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Сколько целей на одной странице списка и клавиатуры выполнения
+GOALS_PAGE_SIZE = int(os.getenv("GOALS_PAGE_SIZE", "10"))
 
 logging.basicConfig(level=logging.INFO)
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
-
-# ==================== БАЗА ДАННЫХ ====================
-async def init_db():
-    async with aiosqlite.connect("game_bot.db") as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                hp INTEGER DEFAULT 0,
-                level INTEGER DEFAULT 1,
-                bronze INTEGER DEFAULT 0,
-                silver INTEGER DEFAULT 0,
-                gold INTEGER DEFAULT 0,
-                total_tasks INTEGER DEFAULT 0,
-                last_daily TEXT
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                title TEXT,
-                difficulty TEXT,
-                completed BOOLEAN DEFAULT 0,
-                date TEXT
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS skills (
-                user_id INTEGER,
-                skill_name TEXT,
-                PRIMARY KEY (user_id, skill_name)
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS achievements (
-                user_id INTEGER,
-                achievement_name TEXT,
-                achieved_date TEXT,
-                PRIMARY KEY (user_id, achievement_name)
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS daily_quests (
-                user_id INTEGER,
-                quest_text TEXT,
-                completed BOOLEAN DEFAULT 0,
-                date TEXT,
-                reward_hp INTEGER,
-                reward_bronze INTEGER,
-                reward_silver INTEGER,
-                reward_gold INTEGER
-            )
-        ''')
-        await db.commit()
+limiter = RateLimiter()
+rate_limit = RateLimitMiddleware(limiter)
+bot.session.middleware(rate_limit)
+bot.session.middleware(ApiMetricsMiddleware())
+dp = Dispatcher(storage=SQLiteStorage(db), events_isolation=UserEventIsolation())
+# FSM-middleware (замок пользователя и чтение состояния) переставляем в
+# конец цепочки: замеры видят ожидание замка, а антифлуд отбрасывает
+# лишнее до замка и до хранилища состояний
+dp.update.outer_middleware.unregister(dp.fsm)
+instrument_dispatcher(dp)
+anti_flood = AntiFloodMiddleware()
+dp.update.outer_middleware(anti_flood)
+dp.update.outer_middleware(dp.fsm)
+instrument_database(db)
+
+@metrics.collector
+def collect_runtime():
+    cache = user_cache.stats()
+    return [
+        ("bot_api_sent_total", (), rate_limit.sent),
+        ("bot_api_retries_total", (), rate_limit.retried),
+        ("bot_api_failed_total", (), rate_limit.failed),
+        ("bot_send_queue", (), limiter.queued),
+        ("bot_send_wait_seconds_total", (), limiter.wait_time),
+        ("bot_user_cache_size", (), cache["size"]),
+        ("bot_user_cache_hits_total", (), cache["hits"]),
+        ("bot_user_cache_misses_total", (), cache["misses"]),
+        ("bot_fsm_cache_hits_total", (), dp.storage.hits),
+        ("bot_fsm_cache_misses_total", (), dp.storage.misses),
+        ("bot_leaderboard_players", (), len(leaderboard)),
+        ("bot_flood_tracked_users", (), len(anti_flood)),
+        ("bot_advice_cache_size", (), len(advisor)),
+        ("bot_advice_computed_total", (), advisor.computed),
+    ] + [
+        ("bot_flood_dropped_total", (("reason", reason),), count)
+        for reason, count in anti_flood.dropped.items()
+    ]
 
 # ==================== КНОПКИ ====================
 def main_keyboard():
@@ -80,7 +84,8 @@ def main_keyboard():
         keyboard=[
             [KeyboardButton(text="🎮 Игра"), KeyboardButton(text="👤 Профиль")],
             [KeyboardButton(text="📋 Квесты"), KeyboardButton(text="🏆 Достижения")],
-            [KeyboardButton(text="🛒 Магазин"), KeyboardButton(text="🤖 AI Помощник")]
+            [KeyboardButton(text="🛒 Магазин"), KeyboardButton(text="🤖 AI Помощник")],
+            [KeyboardButton(text="🏅 Рейтинг"), KeyboardButton(text="📜 История"), KeyboardButton(text="📈 Статистика")]
         ],
         resize_keyboard=True
     )
@@ -98,149 +103,106 @@ def game_keyboard():
 
 # ==================== AI ПОМОЩНИК ====================
 async def get_ai_advice(user_id):
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute("SELECT hp, level, total_tasks FROM users WHERE user_id = ?", (user_id,))
-        user = await cursor.fetchone()
-        
-    if not user:
-        return "🌟 Начни игру! Добавь первую цель."
-    
-    hp, level, total_tasks = user
-    
-    advices = [
-        "💪 Маленькие шаги каждый день приводят к большим результатам!",
-        "🎯 Разбей большую цель на маленькие задачи — так легче начать.",
-        "🌟 Каждая выполненная цель делает тебя сильнее!",
-        "📚 Учись новому каждый день — это прокачивает мозг.",
-        "🏆 Ты уже выполнил " + str(total_tasks) + " задач! Так держать!",
-        "⚡️ Самое сложное — начать. Сделай первый шаг прямо сейчас!",
-        "🎮 Отдых тоже важен. Не забывай про перерывы.",
-        "🌈 Верь в себя — у тебя всё получится!"
-    ]
-    
-    return random.choice(advices)
+    # Советы считаются в фоне (см. advisor.py), здесь — чтение из кэша
+    advice = await advisor.get(user_id)
+    return advice or "🌟 Начни игру! Добавь первую цель."
 
 # ==================== ДОСТИЖЕНИЯ ====================
-async def check_achievements(user_id):
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute("SELECT hp, level, total_tasks FROM users WHERE user_id = ?", (user_id,))
-        user = await cursor.fetchone()
-        if not user:
-            return []
-        
-        hp, level, total_tasks = user
-        
-        achievements_to_check = [
-            ("💪 Новичок", "Выполнить первую задачу", total_tasks >= 1, 50, 5, 0, 0),
-            ("🔥 Труженик", "Выполнить 10 задач", total_tasks >= 10, 100, 10, 5, 0),
-            ("🏆 Мастер", "Выполнить 50 задач", total_tasks >= 50, 300, 20, 10, 5),
-            ("⭐️ Легенда", "Выполнить 100 задач", total_tasks >= 100, 500, 50, 25, 10),
-            ("📈 Уровень 5", "Достичь 5 уровня", level >= 5, 100, 10, 5, 1),
-            ("📈 Уровень 10", "Достичь 10 уровня", level >= 10, 200, 20, 10, 3),
-            ("❤️ 1000 HP", "Накопить 1000 опыта", hp >= 1000, 300, 30, 15, 5),
-        ]
-        
-        new_achievements = []
-        
-        for name, desc, condition, hp_reward, b_reward, s_reward, g_reward in achievements_to_check:
-            if condition:
-                cursor = await db.execute(
-                    "SELECT * FROM achievements WHERE user_id = ? AND achievement_name = ?",
-                    (user_id, name)
-                )
-                existing = await cursor.fetchone()
-                
-                if not existing:
-                    await db.execute(
-                        "INSERT INTO achievements (user_id, achievement_name, achieved_date) VALUES (?, ?, ?)",
-                        (user_id, name, datetime.now().isoformat())
-                    )
-                    await db.execute(
-                        "UPDATE users SET hp = hp + ?, bronze = bronze + ?, silver = silver + ?, gold = gold + ? WHERE user_id = ?",
-                        (hp_reward, b_reward, s_reward, g_reward, user_id)
-                    )
-                    new_achievements.append((name, desc, hp_reward, b_reward, s_reward, g_reward))
-        
-        await db.commit()
-        return new_achievements
+async def give_reward(conn, user_id, reward, source, ref=None, total_tasks=0):
+    # Начисляет награду внутри операции записи (с записью в журнал) и сразу
+    # выдаёт достижения, пороги которых пересекло это изменение
+    hp, b, s, g = reward
+    cursor = await conn.execute(
+        "UPDATE users SET hp = hp + ?, bronze = bronze + ?, silver = silver + ?, gold = gold + ?, total_tasks = total_tasks + ? WHERE user_id = ? RETURNING hp, level, total_tasks, achievements_mask",
+        (hp, b, s, g, total_tasks, user_id)
+    )
+    rows = await cursor.fetchall()
+    if not rows:
+        return []
+    await record(conn, user_id, source, reward, ref)
+    
+    new_hp, level, new_total, mask = rows[0]
+    before = {"hp": new_hp - hp, "level": level, "total_tasks": new_total - total_tasks}
+    after = {"hp": new_hp, "level": level, "total_tasks": new_total}
+    return await grant(conn, user_id, before, after, mask)
 
-# ==================== ЕЖЕДНЕВНЫЕ КВЕСТЫ ====================
-async def generate_daily_quests(user_id):
-    today = datetime.now().date().isoformat()
-    
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute(
-            "SELECT * FROM daily_quests WHERE user_id = ? AND date = ?",
-            (user_id, today)
-        )
-        existing = await cursor.fetchall()
-        
-        if not existing:
-            quests = [
-                ("📚 Прочитать 10 страниц книги", 20, 2, 1, 0),
-                ("🏃 Сделать зарядку", 15, 1, 1, 0),
-                ("💧 Выпить 2 литра воды", 10, 3, 0, 0),
-                ("🧠 Выучить 5 новых слов", 25, 0, 2, 1),
-                ("🧹 Убраться в комнате", 30, 2, 2, 0),
-                ("📝 Написать планы на завтра", 15, 2, 1, 0),
-                ("🎨 Позаниматься творчеством", 25, 1, 2, 1),
-                ("🧘 Помедитировать 10 минут", 20, 2, 2, 0),
-            ]
-            
-            selected = random.sample(quests, 3)
-            
-            for quest_text, hp, b, s, g in selected:
-                await db.execute(
-                    "INSERT INTO daily_quests (user_id, quest_text, date, reward_hp, reward_bronze, reward_silver, reward_gold) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (user_id, quest_text, today, hp, b, s, g)
-                )
-            
-            await db.commit()
+def cache_reward(user_id, reward, earned, total_tasks=0, streak=None):
+    hp, b, s, g = reward
+    mask = 0
+    for a in earned:
+        hp, b, s, g = hp + a.hp, b + a.bronze, s + a.silver, g + a.gold
+        mask |= a.flag
+    user_cache.apply(user_id, hp=hp, bronze=b, silver=s, gold=g, total_tasks=total_tasks, achievements_mask=mask, streak=streak)
+    leaderboard.apply(user_id, hp=hp, total_tasks=total_tasks)
+    advisor.mark(user_id)
+
+def achievements_text(earned):
+    text = "🏆 **Новые достижения!**\n\n"
+    for a in earned:
+        text += f"✨ {a.name}: {a.description}\n"
+        text += f"Награда: +{a.hp} HP, +{a.bronze}🟤 +{a.silver}⚪️ +{a.gold}🟡\n\n"
+    return text
 
+# ==================== ЕЖЕДНЕВНЫЕ КВЕСТЫ ====================
 async def get_daily_quests(user_id):
-    today = datetime.now().date().isoformat()
-    await generate_daily_quests(user_id)
+    today = clock.today(user_id).isoformat()
+    query = "SELECT quest_text, completed, reward_hp, reward_bronze, reward_silver, reward_gold FROM daily_quests WHERE user_id = ? AND date = ? ORDER BY slot"
     
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute(
-            "SELECT quest_text, completed, reward_hp, reward_bronze, reward_silver, reward_gold FROM daily_quests WHERE user_id = ? AND date = ?",
-            (user_id, today)
-        )
-        return await cursor.fetchall()
+    # Активным пользователям квесты создаёт смена дня их пояса (daily.py);
+    # сюда генерация доходит только для новых и вернувшихся
+    quests = await db.fetchall(query, (user_id, today))
+    if not quests:
+        await generate_for_users([user_id], today)
+        quests = await db.fetchall(query, (user_id, today))
+    return quests
 
 async def complete_daily_quest(user_id, quest_index):
-    today = datetime.now().date().isoformat()
-    
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute(
-            "SELECT rowid, quest_text, completed, reward_hp, reward_bronze, reward_silver, reward_gold FROM daily_quests WHERE user_id = ? AND date = ?",
-            (user_id, today)
+    day = clock.today(user_id)
+    today = day.isoformat()
+    
+    async def op(conn):
+        # Проверка и отметка — одно условное обновление: повторное нажатие
+        # не найдёт строку с completed = 0 и награду не получит
+        cursor = await conn.execute(
+            "UPDATE daily_quests SET completed = 1 WHERE user_id = ? AND date = ? AND slot = ? AND completed = 0 "
+            "RETURNING reward_hp, reward_bronze, reward_silver, reward_gold",
+            (user_id, today, quest_index)
         )
-        quests = await cursor.fetchall()
+        rows = await cursor.fetchall()
         
-        if 0 <= quest_index < len(quests) and not quests[quest_index][2]:
-            quest = quests[quest_index]
-            await db.execute(
-                "UPDATE daily_quests SET completed = 1 WHERE rowid = ?",
-                (quest[0],)
-            )
-            await db.execute(
-                "UPDATE users SET hp = hp + ?, bronze = bronze + ?, silver = silver + ?, gold = gold + ? WHERE user_id = ?",
-                (quest[3], quest[4], quest[5], quest[6], user_id)
-            )
-            await db.commit()
-            return quest[3], quest[4], quest[5], quest[6]
-    
-    return None
+        if not rows:
+            return None
+        reward = tuple(rows[0])
+        earned = await give_reward(conn, user_id, reward, SOURCE_QUEST, ref=f"{today}#{quest_index}")
+        await add_daily(conn, user_id, today, reward, earned, quests=1)
+        return reward, earned, await touch_streak(conn, user_id, day)
+    
+    result = await db.run(op)
+    if not result:
+        return None
+    reward, earned, streak = result
+    cache_reward(user_id, reward, earned, streak=streak)
+    return reward, earned
 
 # ==================== ХЕНДЛЕРЫ ====================
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     user_id = message.from_user.id
     
-    async with aiosqlite.connect("game_bot.db") as db:
-        await db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
-        await db.commit()
+    name = message.from_user.first_name
+    
+    async def op(conn):
+        # Имя обновляем при каждом /start — оно показывается в рейтинге
+        cursor = await conn.execute("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)", (user_id, name))
+        if cursor.rowcount:
+            return True
+        await conn.execute("UPDATE users SET name = ? WHERE user_id = ?", (name, user_id))
+        return False
+    
+    if await db.run(op):
+        user_cache.invalidate(user_id)
+        leaderboard.apply(user_id)
+        advisor.mark(user_id)
     
     await message.answer(
         "🌟 Добро пожаловать в LifeRPG!\n\n"
@@ -253,137 +215,358 @@ async def cmd_start(message: types.Message):
 async def profile(message: types.Message):
     user_id = message.from_user.id
     
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute("SELECT hp, level, bronze, silver, gold, total_tasks FROM users WHERE user_id = ?", (user_id,))
-        user = await cursor.fetchone()
-        
-        cursor = await db.execute("SELECT skill_name FROM skills WHERE user_id = ?", (user_id,))
-        skills = await cursor.fetchall()
-        
-        cursor = await db.execute("SELECT achievement_name FROM achievements WHERE user_id = ?", (user_id,))
-        achievements = await cursor.fetchall()
+    user = await user_cache.get(user_id)
     
     if user:
-        hp, level, bronze, silver, gold, total_tasks = user
-        skills_list = ", ".join([s[0] for s in skills]) if skills else "Нет"
-        achievements_count = len(achievements)
+        skills_list = ", ".join(sorted(user.skills)) if user.skills else "Нет"
+        achievements_count = mask_count(user.achievements_mask)
+        streak = current_streak(user.streak, user.last_daily, clock.today(user_id))
         
         await message.answer(
             f"👤 **Твой профиль**\n\n"
-            f"❤️ HP: {hp}\n"
-            f"📊 Уровень: {level}\n"
-            f"🎯 Выполнено задач: {total_tasks}\n"
-            f"🏆 Достижений: {achievements_count}\n\n"
+            f"❤️ HP: {user.hp}\n"
+            f"📊 Уровень: {user.level}\n"
+            f"🎯 Выполнено задач: {user.total_tasks}\n"
+            f"🏆 Достижений: {achievements_count}\n"
+            f"🔥 Серия: {streak} (рекорд {user.best_streak})\n\n"
             f"🪙 Монеты:\n"
-            f"🟤 Бронза: {bronze}\n"
-            f"⚪️ Серебро: {silver}\n"
-            f"🟡 Золото: {gold}\n\n"
+            f"🟤 Бронза: {user.bronze}\n"
+            f"⚪️ Серебро: {user.silver}\n"
+            f"🟡 Золото: {user.gold}\n\n"
             f"🧠 Навыки: {skills_list}",
             parse_mode="Markdown",
             reply_markup=main_keyboard()
         )
 
+@dp.message(F.text == "🏅 Рейтинг")
+async def show_leaderboard(message: types.Message):
+    user_id = message.from_user.id
+    
+    top = leaderboard.top()
+    if not top:
+        await message.answer("🏅 Рейтинг пока пуст")
+        return
+    
+    # Имена только для строк топа — выборка по первичному ключу
+    ids = [row[0] for row in top]
+    names = dict(await db.fetchall(
+        f"SELECT user_id, name FROM users WHERE user_id IN ({', '.join('?' * len(ids))})", ids
+    ))
+    
+    text = "🏅 Рейтинг игроков\n\n"
+    for place, (uid, hp, total_tasks) in enumerate(top, 1):
+        you = " ← ты" if uid == user_id else ""
+        text += f"{place}. {names.get(uid) or 'Игрок'} — {hp}❤️, задач: {total_tasks}{you}\n"
+    
+    rank = leaderboard.rank(user_id)
+    if rank is None:
+        text += "\nТебя пока нет в рейтинге — нажми /start"
+    elif rank > len(top):
+        text += f"\nТвоё место: {rank} из {len(leaderboard)}"
+    
+    await message.answer(text)
+
+@dp.message(F.text == "📜 История")
+async def show_history(message: types.Message):
+    rows = await history(message.from_user.id)
+    
+    if not rows:
+        await message.answer("📜 Пока ни одного начисления")
+        return
+    
+    text = "📜 Последние начисления и траты\n\n"
+    for ts, source, ref, hp, b, s, g in rows:
+        parts = [f"{value:+}{sign}" for value, sign in ((hp, "❤️"), (b, "🟤"), (s, "⚪️"), (g, "🟡")) if value]
+        title = SOURCE_TITLES.get(source, source)
+        if source != SOURCE_TASK and source != SOURCE_QUEST and ref:
+            title += f": {ref}"
+        text += f"{datetime.fromisoformat(ts).strftime('%d.%m %H:%M')} {title} {' '.join(parts)}\n"
+    
+    await message.answer(text)
+
+@dp.message(F.text == "📈 Статистика")
+async def show_stats(message: types.Message):
+    user_id = message.from_user.id
+    today = clock.today(user_id)
+    
+    # Четыре недели по дням — не больше 28 строк сводки
+    first = today - timedelta(days=27)
+    days = await daily_range(user_id, first, today)
+    months = await monthly(user_id, 6, today)
+    
+    if not days and not months:
+        await message.answer("📈 Статистика появится, когда выполнишь первую цель или квест")
+        return
+    
+    def tasks_on(day):
+        row = days.get(day.isoformat())
+        return sum(row[:3]) if row else 0
+    
+    week = [today - timedelta(days=i) for i in range(6, -1, -1)]
+    peak = max(tasks_on(day) for day in week) or 1
+    text = "📈 Статистика\n\nЗа 7 дней (цели):\n"
+    for day in week:
+        count = tasks_on(day)
+        text += f"{day.strftime('%d.%m')} {'▇' * round(count / peak * 10)} {count}\n"
+    
+    week_totals = [0] * 8
+    for row in days.values():
+        week_totals = [total + value for total, value in zip(week_totals, row)]
+    easy, medium, hard, quests, hp, b, s, g = week_totals
+    text += (
+        f"\nЗа 4 недели:\n"
+        f"🎯 Целей: {easy + medium + hard} (🟤 {easy} ⚪️ {medium} 🟡 {hard})\n"
+        f"📋 Квестов: {quests}\n"
+        f"❤️ +{hp} HP, 🟤 +{b} ⚪️ +{s} 🟡 +{g}\n"
+    )
+    
+    if months:
+        text += "\nПо месяцам:\n"
+        for month, tasks, quests, hp in months:
+            text += f"{month}: целей {tasks}, квестов {quests}, +{hp}❤️\n"
+    
+    await message.answer(text)
+
 @dp.message(F.text == "🎮 Игра")
 async def game_menu(message: types.Message):
     await message.answer("🎮 Меню игры", reply_markup=game_keyboard())
 
 @dp.message(F.text == "◀️ Назад")
-async def back_to_main(message: types.Message):
+async def back_to_main(message: types.Message, state: FSMContext):
+    await state.clear()
     await message.answer("Главное меню", reply_markup=main_keyboard())
 
+class AddGoal(StatesGroup):
+    title = State()
+    difficulty = State()
+
+def difficulty_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="🟤 1", callback_data="goal_diff_1"),
+        InlineKeyboardButton(text="⚪️ 2", callback_data="goal_diff_2"),
+        InlineKeyboardButton(text="🟡 3", callback_data="goal_diff_3"),
+    ]])
+
+async def create_goal(user_id, title, difficulty):
+    await db.execute(
+        "INSERT INTO tasks (user_id, title, difficulty, created_at) VALUES (?, ?, ?, ?)",
+        (user_id, title, difficulty, clock.now(user_id).isoformat(timespec="seconds"))
+    )
+    advisor.mark(user_id)
+    diff_emoji = "🟤" if difficulty == 1 else "⚪️" if difficulty == 2 else "🟡"
+    return f"✅ Цель добавлена: {diff_emoji} {title}"
+
 @dp.message(F.text == "➕ Добавить цель")
-async def add_goal_prompt(message: types.Message):
+async def add_goal_prompt(message: types.Message, state: FSMContext):
+    await state.set_state(AddGoal.title)
     await message.answer(
-        "✍️ Напиши цель в формате:\n"
-        "Название | сложность\n\n"
-        "Сложность: 1 (легко), 2 (средне), 3 (сложно)"
+        "✍️ Напиши название цели\n\n"
+        "Можно сразу со сложностью: Название | 1, 2 или 3"
     )
 
+# Команды (/remind, /tz, ...) в шагах диалога не перехватываются как ввод
+@dp.message(AddGoal.title, F.text, ~F.text.startswith("/"))
+async def add_goal_title(message: types.Message, state: FSMContext):
+    title, _, difficulty = message.text.partition("|")
+    title = title.strip()
+    difficulty = difficulty.strip()
+    
+    if not title:
+        await message.answer("✍️ Название не может быть пустым")
+        return
+    
+    if difficulty in ("1", "2", "3"):
+        await state.clear()
+        await message.answer(await create_goal(message.from_user.id, title, int(difficulty)))
+        return
+    
+    await state.set_state(AddGoal.difficulty)
+    await state.update_data(title=title)
+    await message.answer(
+        "Выбери сложность: 1 (легко), 2 (средне), 3 (сложно)",
+        reply_markup=difficulty_keyboard()
+    )
+
+async def finish_goal(user_id, state: FSMContext, difficulty):
+    data = await state.get_data()
+    await state.clear()
+    return await create_goal(user_id, data["title"], difficulty)
+
+@dp.message(AddGoal.difficulty, F.text.in_({"1", "2", "3"}))
+async def add_goal_difficulty(message: types.Message, state: FSMContext):
+    await message.answer(await finish_goal(message.from_user.id, state, int(message.text)))
+
+@dp.message(AddGoal.difficulty, ~F.text.startswith("/"))
+async def add_goal_difficulty_invalid(message: types.Message):
+    await message.answer("❌ Сложность должна быть 1, 2 или 3", reply_markup=difficulty_keyboard())
+
+@dp.callback_query(AddGoal.difficulty, F.data.startswith("goal_diff_"))
+async def add_goal_difficulty_button(callback: types.CallbackQuery, state: FSMContext):
+    text = await finish_goal(callback.from_user.id, state, int(callback.data.split("_")[2]))
+    await callback.answer()
+    await callback.message.edit_text(text)
+
+@dp.callback_query(F.data.startswith("goal_diff_"))
+async def add_goal_difficulty_stale(callback: types.CallbackQuery):
+    # Кнопка со старой клавиатуры, диалог уже закончен
+    await callback.answer("⌛ Эта кнопка устарела — добавь цель заново")
+
+async def fetch_goals_page(user_id, after=0, before=None):
+    # Keyset-пагинация по id: страница — это LIMIT от границы, без OFFSET,
+    # поэтому любая страница стоит одинаково при сотнях открытых целей.
+    # Возвращает (цели, есть ли предыдущая, есть ли следующая).
+    async with db.reader() as conn:
+        if before is None:
+            cursor = await conn.execute(
+                "SELECT id, title, difficulty FROM tasks WHERE user_id = ? AND completed = 0 AND id > ? ORDER BY id LIMIT ?",
+                (user_id, after, GOALS_PAGE_SIZE + 1)
+            )
+            tasks = await cursor.fetchall()
+            has_next = len(tasks) > GOALS_PAGE_SIZE
+            tasks = tasks[:GOALS_PAGE_SIZE]
+            # Есть ли что-то левее страницы
+            cursor = await conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM tasks WHERE user_id = ? AND completed = 0 AND id < ?)",
+                (user_id, tasks[0][0] if tasks else after + 1)
+            )
+            has_prev = bool((await cursor.fetchone())[0])
+        else:
+            cursor = await conn.execute(
+                "SELECT id, title, difficulty FROM tasks WHERE user_id = ? AND completed = 0 AND id < ? ORDER BY id DESC LIMIT ?",
+                (user_id, before, GOALS_PAGE_SIZE + 1)
+            )
+            tasks = await cursor.fetchall()
+            has_prev = len(tasks) > GOALS_PAGE_SIZE
+            tasks = tasks[:GOALS_PAGE_SIZE][::-1]
+            # Есть ли что-то правее страницы
+            cursor = await conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM tasks WHERE user_id = ? AND completed = 0 AND id > ?)",
+                (user_id, tasks[-1][0] if tasks else before - 1)
+            )
+            has_next = bool((await cursor.fetchone())[0])
+    
+    return tasks, has_prev, has_next
+
+def goals_nav(kind, tasks, has_prev, has_next):
+    # kind: list — «Мои цели», done — выбор цели для выполнения
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"goals_{kind}_prev_{tasks[0][0]}"))
+    if has_next:
+        row.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=f"goals_{kind}_next_{tasks[-1][0]}"))
+    return [row] if row else []
+
+def goal_emoji(diff):
+    return "🟤" if diff == "1" else "⚪️" if diff == "2" else "🟡"
+
+def goals_list_view(tasks, has_prev, has_next):
+    text = "📋 **Твои цели:**\n\n"
+    for task_id, title, diff in tasks:
+        text += f"{goal_emoji(diff)} {title}\n"
+    buttons = goals_nav("list", tasks, has_prev, has_next)
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+
+def goals_done_view(tasks, has_prev, has_next):
+    buttons = []
+    for task_id, title, diff in tasks:
+        buttons.append([InlineKeyboardButton(text=f"{goal_emoji(diff)} {title}", callback_data=f"complete_{task_id}")])
+    buttons += goals_nav("done", tasks, has_prev, has_next)
+    return "✅ Какую цель выполнил?", InlineKeyboardMarkup(inline_keyboard=buttons)
+
 @dp.message(F.text == "📋 Мои цели")
 async def show_goals(message: types.Message):
     user_id = message.from_user.id
     
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute(
-            "SELECT id, title, difficulty FROM tasks WHERE user_id = ? AND completed = 0",
-            (user_id,)
-        )
-        tasks = await cursor.fetchall()
+    tasks, has_prev, has_next = await fetch_goals_page(user_id)
     
     if not tasks:
         await message.answer("📭 У тебя нет активных целей")
         return
     
-    text = "📋 **Твои цели:**\n\n"
-    for i, (task_id, title, diff) in enumerate(tasks):
-        emoji = "🟤" if diff == "1" else "⚪️" if diff == "2" else "🟡"
-        text += f"{i+1}. {emoji} {title}\n"
-    
-    await message.answer(text, parse_mode="Markdown")
+    text, keyboard = goals_list_view(tasks, has_prev, has_next)
+    await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
 
 @dp.message(F.text == "✅ Выполнить цель")
 async def complete_goal_prompt(message: types.Message):
     user_id = message.from_user.id
     
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute(
-            "SELECT id, title, difficulty FROM tasks WHERE user_id = ? AND completed = 0",
-            (user_id,)
-        )
-        tasks = await cursor.fetchall()
+    tasks, has_prev, has_next = await fetch_goals_page(user_id)
     
     if not tasks:
         await message.answer("📭 Нет целей для выполнения")
         return
     
-    buttons = []
-    for task_id, title, diff in tasks:
-        emoji = "🟤" if diff == "1" else "⚪️" if diff == "2" else "🟡"
-        buttons.append([InlineKeyboardButton(text=f"{emoji} {title}", callback_data=f"complete_{task_id}")])
+    text, keyboard = goals_done_view(tasks, has_prev, has_next)
+    await message.answer(text, reply_markup=keyboard)
+
+@dp.callback_query(F.data.startswith("goals_"))
+async def goals_page(callback: types.CallbackQuery):
+    _, kind, direction, edge = callback.data.split("_")
+    edge = int(edge)
+    
+    if direction == "next":
+        tasks, has_prev, has_next = await fetch_goals_page(callback.from_user.id, after=edge)
+    else:
+        tasks, has_prev, has_next = await fetch_goals_page(callback.from_user.id, before=edge)
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await message.answer("✅ Какую цель выполнил?", reply_markup=keyboard)
+    await callback.answer()
+    if not tasks:
+        await callback.message.edit_text("📭 Больше целей нет")
+        return
+    
+    if kind == "list":
+        text, keyboard = goals_list_view(tasks, has_prev, has_next)
+        await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
+    else:
+        text, keyboard = goals_done_view(tasks, has_prev, has_next)
+        await callback.message.edit_text(text, reply_markup=keyboard)
 
 @dp.callback_query(F.data.startswith("complete_"))
 async def complete_task(callback: types.CallbackQuery):
     task_id = int(callback.data.split("_")[1])
     user_id = callback.from_user.id
     
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute("SELECT difficulty FROM tasks WHERE id = ? AND user_id = ?", (task_id, user_id))
-        task = await cursor.fetchone()
+    async def op(conn):
+        now = clock.now(user_id)
+        day = now.date()
+        cursor = await conn.execute(
+            "UPDATE tasks SET completed = 1, completed_at = ? WHERE id = ? AND user_id = ? AND completed = 0 RETURNING difficulty",
+            (now.isoformat(timespec="seconds"), task_id, user_id)
+        )
+        rows = await cursor.fetchall()
         
-        if task:
-            diff = int(task[0])
-            
-            if diff == 1:
-                hp, b, s, g = 10, 2, 0, 0
-            elif diff == 2:
-                hp, b, s, g = 20, 0, 2, 0
-            else:
-                hp, b, s, g = 30, 0, 0, 1
-            
-            await db.execute("UPDATE tasks SET completed = 1 WHERE id = ?", (task_id,))
-            await db.execute(
-                "UPDATE users SET hp = hp + ?, bronze = bronze + ?, silver = silver + ?, gold = gold + ?, total_tasks = total_tasks + 1 WHERE user_id = ?",
-                (hp, b, s, g, user_id)
-            )
-            await db.commit()
-            
-            await callback.answer("✅ Цель выполнена!")
-            await callback.message.edit_text(
-                f"🎉 Ты получил:\n"
-                f"❤️ +{hp} HP\n"
-                f"🟤 +{b} бронзы\n⚪️ +{s} серебра\n🟡 +{g} золота"
-            )
-            
-            new_achievements = await check_achievements(user_id)
-            if new_achievements:
-                text = "🏆 **Новые достижения!**\n\n"
-                for name, desc, hp_r, b_r, s_r, g_r in new_achievements:
-                    text += f"✨ {name}: {desc}\n"
-                    text += f"Награда: +{hp_r} HP, +{b_r}🟤 +{s_r}⚪️ +{g_r}🟡\n\n"
-                await callback.message.answer(text, parse_mode="Markdown")
+        if not rows:
+            return None
+        
+        diff = int(rows[0][0])
+        
+        if diff == 1:
+            reward = 10, 2, 0, 0
+        elif diff == 2:
+            reward = 20, 0, 2, 0
+        else:
+            reward = 30, 0, 0, 1
+        
+        earned = await give_reward(conn, user_id, reward, SOURCE_TASK, ref=str(task_id), total_tasks=1)
+        await add_daily(conn, user_id, day.isoformat(), reward, earned, difficulty=diff)
+        return reward, earned, await touch_streak(conn, user_id, day)
+    
+    result = await db.run(op)
+    if not result:
+        await callback.answer("❌ Цель уже выполнена или не найдена")
+        return
+    reward, earned, streak = result
+    cache_reward(user_id, reward, earned, total_tasks=1, streak=streak)
+    hp, b, s, g = reward
+    
+    reply = CallbackReply(callback).add(
+        f"🎉 Ты получил:\n"
+        f"❤️ +{hp} HP\n"
+        f"🟤 +{b} бронзы\n⚪️ +{s} серебра\n🟡 +{g} золота"
+    )
+    if earned:
+        reply.add(achievements_text(earned), markdown=True)
+    await reply.send("✅ Цель выполнена!")
 
 @dp.message(F.text == "📋 Квесты")
 async def show_quests(message: types.Message):
@@ -417,20 +600,14 @@ async def complete_quest(callback: types.CallbackQuery):
     result = await complete_daily_quest(user_id, quest_index)
     
     if result:
-        hp, b, s, g = result
-        await callback.answer("✅ Квест выполнен!")
-        await callback.message.edit_text(
+        (hp, b, s, g), earned = result
+        reply = CallbackReply(callback).add(
             f"🎉 Квест выполнен!\n"
             f"Награда: +{hp}❤️ +{b}🟤 +{s}⚪️ +{g}🟡"
         )
-        
-        new_achievements = await check_achievements(user_id)
-        if new_achievements:
-            text = "🏆 **Новые достижения!**\n\n"
-            for name, desc, hp_r, b_r, s_r, g_r in new_achievements:
-                text += f"✨ {name}: {desc}\n"
-                text += f"Награда: +{hp_r} HP, +{b_r}🟤 +{s_r}⚪️ +{g_r}🟡\n\n"
-            await callback.message.answer(text, parse_mode="Markdown")
+        if earned:
+            reply.add(achievements_text(earned), markdown=True)
+        await reply.send("✅ Квест выполнен!")
     else:
         await callback.answer("❌ Квест уже выполнен или не найден")
 
@@ -438,9 +615,7 @@ async def complete_quest(callback: types.CallbackQuery):
 async def show_achievements(message: types.Message):
     user_id = message.from_user.id
     
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute("SELECT achievement_name, achieved_date FROM achievements WHERE user_id = ?", (user_id,))
-        achievements = await cursor.fetchall()
+    achievements = await db.fetchall("SELECT achievement_name, achieved_date FROM achievements WHERE user_id = ?", (user_id,))
     
     if not achievements:
         await message.answer("🏆 У тебя пока нет достижений. Выполняй цели и получай их!")
@@ -489,103 +664,217 @@ async def buy_skill(callback: types.CallbackQuery):
     skill_key = callback.data.split("_")[1]
     skill_name, cost_b, cost_s, cost_g = skills[skill_key]
     
-    async with aiosqlite.connect("game_bot.db") as db:
-        cursor = await db.execute("SELECT bronze, silver, gold FROM users WHERE user_id = ?", (user_id,))
-        user = await cursor.fetchone()
-        
-        if user and user[0] >= cost_b and user[1] >= cost_s and user[2] >= cost_g:
-            await db.execute(
-                "UPDATE users SET bronze = bronze - ?, silver = silver - ?, gold = gold - ? WHERE user_id = ?",
-                (cost_b, cost_s, cost_g, user_id)
-            )
-            await db.execute(
-                "INSERT OR IGNORE INTO skills (user_id, skill_name) VALUES (?, ?)",
-                (user_id, skill_name)
-            )
-            await db.commit()
-            await callback.answer(f"✅ Навык {skill_name} куплен!")
-            await callback.message.edit_text(f"🎉 Ты купил навык {skill_name}!")
-        else:
-            await callback.answer("❌ Недостаточно монет!")
+    async def op(conn):
+        # Проверка баланса и списание — один условный UPDATE; уже купленный
+        # навык повторно не оплачивается
+        cursor = await conn.execute(
+            "UPDATE users SET bronze = bronze - ?, silver = silver - ?, gold = gold - ? "
+            "WHERE user_id = ? AND bronze >= ? AND silver >= ? AND gold >= ? "
+            "AND NOT EXISTS (SELECT 1 FROM skills WHERE user_id = users.user_id AND skill_name = ?)",
+            (cost_b, cost_s, cost_g, user_id, cost_b, cost_s, cost_g, skill_name)
+        )
+        if cursor.rowcount:
+            await conn.execute("INSERT INTO skills (user_id, skill_name) VALUES (?, ?)", (user_id, skill_name))
+            await record(conn, user_id, SOURCE_PURCHASE, (0, -cost_b, -cost_s, -cost_g), skill_name)
+            return "bought"
+        cursor = await conn.execute("SELECT 1 FROM skills WHERE user_id = ? AND skill_name = ?", (user_id, skill_name))
+        return "owned" if await cursor.fetchone() else "poor"
+    
+    result = await db.run(op)
+    if result == "bought":
+        user_cache.apply(user_id, bronze=-cost_b, silver=-cost_s, gold=-cost_g, skills=(skill_name,))
+        await CallbackReply(callback).add(f"🎉 Ты купил навык {skill_name}!").send(f"✅ Навык {skill_name} куплен!")
+    elif result == "owned":
+        await callback.answer(f"✅ Навык {skill_name} у тебя уже есть")
+    else:
+        await callback.answer("❌ Недостаточно монет!")
 
-@dp.message()
-async def handle_text(message: types.Message):
-    user_id = message.from_user.id
+# ==================== НАПОМИНАНИЯ ====================
+@dp.message(Command("remind"))
+async def cmd_remind(message: types.Message):
+    usage = (
+        "⏰ Формат: /remind ЧЧ:ММ [дни] текст\n"
+        "Дни через запятую: пн,вт,ср,чт,пт,сб,вс (по умолчанию — каждый день)\n\n"
+        "Пример: /remind 07:30 пн,ср,пт Зарядка!"
+    )
+    parts = (message.text or "").split(maxsplit=3)
+    if len(parts) < 3:
+        await message.answer(usage)
+        return
+    
+    try:
+        hour, minute = (int(x) for x in parts[1].split(":"))
+    except ValueError:
+        await message.answer(usage)
+        return
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        await message.answer(usage)
+        return
     
-    if "|" in message.text:
-        try:
-            title, difficulty = message.text.split("|")
-            difficulty = int(difficulty.strip())
-            title = title.strip()
-            
-            if difficulty not in [1, 2, 3]:
-                await message.answer("❌ Сложность должна быть 1, 2 или 3")
-                return
-            
-            async with aiosqlite.connect("game_bot.db") as db:
-                await db.execute(
-                    "INSERT INTO tasks (user_id, title, difficulty) VALUES (?, ?, ?)",
-                    (user_id, title, difficulty)
-                )
-                await db.commit()
-            
-            diff_emoji = "🟤" if difficulty == 1 else "⚪️" if difficulty == 2 else "🟡"
-            await message.answer(f"✅ Цель добавлена: {diff_emoji} {title}")
-            
-        except ValueError:
-            await message.answer("❌ Ошибка формата. Используй: Название | сложность (1, 2 или 3)")
+    weekdays = parse_weekdays(parts[2])
+    if weekdays is None:
+        weekdays = EVERY_DAY
+        text = " ".join(parts[2:])
+    elif len(parts) == 4:
+        text = parts[3]
     else:
-        await message.answer("Используй кнопки для навигации", reply_markup=main_keyboard())
+        await message.answer(usage)
+        return
+    
+    rid = await reminders.add(message.from_user.id, hour, minute, weekdays, text)
+    await message.answer(f"✅ Напоминание #{rid}: {hour:02d}:{minute:02d}, {weekdays_text(weekdays)}\n{text}")
+
+@dp.message(Command("reminders"))
+async def cmd_reminders(message: types.Message):
+    rules = reminders.for_user(message.from_user.id)
+    if not rules:
+        await message.answer("⏰ Напоминаний нет. Добавь: /remind ЧЧ:ММ текст")
+        return
+    
+    text = "⏰ Твои напоминания:\n\n"
+    for r in rules:
+        text += f"#{r.id} {r.hour:02d}:{r.minute:02d} ({weekdays_text(r.weekdays)}) — {r.text}\n"
+    text += "\nУдалить: /unremind номер"
+    await message.answer(text)
+
+@dp.message(Command("unremind"))
+async def cmd_unremind(message: types.Message):
+    parts = (message.text or "").split()
+    if len(parts) != 2 or not parts[1].lstrip("#").isdigit():
+        await message.answer("Формат: /unremind номер")
+        return
+    
+    if await reminders.remove(message.from_user.id, int(parts[1].lstrip("#"))):
+        await message.answer("🗑 Напоминание удалено")
+    else:
+        await message.answer("❌ Напоминание не найдено")
+
+@dp.message(Command("tz"))
+async def cmd_timezone(message: types.Message):
+    parts = (message.text or "").split()
+    if len(parts) != 2 or not is_valid_zone(parts[1]):
+        await message.answer("🌍 Формат: /tz Europe/Minsk")
+        return
+    
+    user_id = message.from_user.id
+    tz = parts[1]
+    await db.execute("INSERT INTO users (user_id, tz) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET tz = excluded.tz", (user_id, tz))
+    user_cache.invalidate(user_id)
+    clock.set_zone(user_id, tz)
+    reminders.set_timezone(user_id, tz)
+    advisor.mark(user_id)
+    await message.answer(f"🌍 Часовой пояс: {tz}")
+
+@dp.message()
+async def handle_text(message: types.Message):
+    await message.answer("Используй кнопки для навигации", reply_markup=main_keyboard())
 
 # ==================== УВЕДОМЛЕНИЯ ====================
 async def send_startup_notification():
     await asyncio.sleep(5)
-    await bot.send_message(YOUR_USER_ID, "🔔 Бот запущен и готов к работе!")
+    post(bot.send_message(YOUR_USER_ID, "🔔 Бот запущен и готов к работе!"))
 
-async def scheduled_notifications():
-    while True:
-        now = (datetime.now() + timedelta(hours=3)).time()
-        week_day = datetime.now().weekday()
-        
-        if now.hour == 7 and now.minute == 0:
-            await bot.send_message(YOUR_USER_ID, "🌅 Доброе утро!\nНе бери телефон первые 10 минут.\nТы справишься сегодня 💪")
-            await asyncio.sleep(60)
-        
-        if now.hour == 15 and now.minute == 30 and week_day < 4:
-            await bot.send_message(YOUR_USER_ID, "📚 Время делать домашку! Убери телефон.")
-        
-        if now.hour == 17 and now.minute == 30 and week_day in [0, 1, 3]:
-            await bot.send_message(YOUR_USER_ID, "🧠 30 минут подготовки к ЦТ/ЦЭ. Физика или математика — погнали")
-        
-        if now.hour == 17 and now.minute == 30 and week_day == 2:
-            await bot.send_message(YOUR_USER_ID, "💻 Через 30 минут курсы по программированию")
-        
-        if now.hour == 18 and now.minute == 0 and week_day == 2:
-            await bot.send_message(YOUR_USER_ID, "💻 Курсы начались. Вникай 🔥")
-        
-        if now.hour == 18 and now.minute == 30 and week_day < 4:
-            await bot.send_message(YOUR_USER_ID, "🎮 Можно отдохнуть 30 минут — но без экрана лучше")
-        
-        if now.hour == 19 and now.minute == 0:
-            await bot.send_message(YOUR_USER_ID, "🎮 Отдыхай! Ты сегодня молодец.")
-        
-        if now.hour == 15 and now.minute == 30 and week_day == 4:
-            await bot.send_message(YOUR_USER_ID, "🧠 Через 30 минут репетитор. Соберись")
-        
-        if now.hour == 16 and now.minute == 0 and week_day == 4:
-            await bot.send_message(YOUR_USER_ID, "🧠 Репетитор по информатике — не опоздай")
-        
-        if now.hour == 11 and now.minute == 0 and week_day >= 5:
-            await bot.send_message(YOUR_USER_ID, "🌿 Выходной, но час физики/математики не помешает.")
-        
-        await asyncio.sleep(60)
+async def send_reminder(user_id, text):
+    # Только ставим в очередь: темп рассылки задаёт ограничитель
+    post(bot.send_message(user_id, text))
+
+reminders = ReminderScheduler(send_reminder)
 
 # ==================== ЗАПУСК ====================
+def database_is_open():
+    return db.is_open
+
+async def worker_main(index, count, queue):
+    # Процесс-обработчик: свои пользователи (user_id % count == index),
+    # своя доля общего лимита отправки, свои напоминания
+    limiter.share(count)
+    reminders.shard = (index, count)
+    advisor.shard = (index, count)
+    # Каждый процесс отдаёт свои метрики: фронт — на METRICS_PORT, обработчики — на следующих портах
+    metrics_runner = await serve_metrics(METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    await db.open()
+    await clock.load()
+    await leaderboard.load()
+    background = [
+        asyncio.create_task(reminders.run()),
+        asyncio.create_task(leaderboard.refresh_loop()),
+        asyncio.create_task(advisor.run()),
+    ]
+    if index == 0:
+        background.append(asyncio.create_task(end_of_day_loop()))
+        background.append(asyncio.create_task(snapshot_loop()))
+        background.append(asyncio.create_task(maintenance_loop()))
+    try:
+        await consume(queue, OrderedFeeder(dp, bot))
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await drain_posts()
+        await limiter.close()
+        await dp.storage.close()
+        await bot.session.close()
+        await db.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+def run_worker(index, count, queue):
+    ignore_interrupts()
+    asyncio.run(worker_main(index, count, queue))
+
+async def run_sharded():
+    # Фронт: миграции, приём обновлений и раскладка по обработчикам
+    await db.open()
+    try:
+        await migrate()
+    finally:
+        await db.close()
+    metrics_runner = await serve_metrics()
+    startup = asyncio.create_task(send_startup_notification())
+    try:
+        await run_front(dp, bot, run_worker, WORKERS, mode=BOT_MODE)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        startup.cancel()
+        await asyncio.gather(startup, return_exceptions=True)
+        await limiter.close()
+        await bot.session.close()
+
 async def main():
-    await init_db()
-    asyncio.create_task(scheduled_notifications())
-    asyncio.create_task(send_startup_notification())
-    await dp.start_polling(bot)
+    if WORKERS > 1:
+        await run_sharded()
+        return
+
+    await db.open()
+    background = []
+    metrics_runner = await serve_metrics()
+    try:
+        await migrate()
+        await clock.load()
+        await leaderboard.load()
+        background = [
+            asyncio.create_task(reminders.run()),
+            asyncio.create_task(send_startup_notification()),
+            asyncio.create_task(end_of_day_loop()),
+            asyncio.create_task(snapshot_loop()),
+            asyncio.create_task(maintenance_loop()),
+            asyncio.create_task(advisor.run()),
+        ]
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot, checks=[database_is_open])
+        else:
+            await dp.start_polling(bot)
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await drain_posts()
+        await limiter.close()
+        await dp.storage.close()
+        await db.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,134 @@
+import asyncio
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from db import db
+
+# ========== НАСТРОЙКИ ==========
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+
+# ==================== СОСТОЯНИЕ ПОЛЬЗОВАТЕЛЯ ====================
+@dataclass
+class UserState:
+    hp: int = 0
+    level: int = 1
+    bronze: int = 0
+    silver: int = 0
+    gold: int = 0
+    total_tasks: int = 0
+    achievements_mask: int = 0
+    streak: int = 0
+    best_streak: int = 0
+    last_daily: str = None
+    skills: set = field(default_factory=set)
+
+
+# ==================== КЭШ ====================
+class UserCache:
+    # Все изменения проходят через этот процесс, поэтому кэш обновляется
+    # сквозной записью: сначала коммит в базу, затем apply() с той же дельтой.
+    # Читатели получают живой объект состояния и не должны его менять.
+
+    def __init__(self, database=db, max_size=USER_CACHE_SIZE):
+        self.db = database
+        self.max_size = max_size
+        self._states = OrderedDict()
+        self._inflight = {}
+        self._stale = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    async def get(self, user_id):
+        state = self._states.get(user_id)
+        if state is not None:
+            self._states.move_to_end(user_id)
+            self.hits += 1
+            return state
+
+        self.misses += 1
+        # Одновременные промахи по одному пользователю ждут одну загрузку
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id):
+        # Если во время чтения пришла запись, прочитанное могло устареть —
+        # перечитываем, иначе дельта потеряется или применится дважды
+        while True:
+            self._stale.discard(user_id)
+            state = await self._read(user_id)
+            if user_id not in self._stale:
+                break
+        if state is not None:
+            self._put(user_id, state)
+        return state
+
+    async def _read(self, user_id):
+        async with self.db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT hp, level, bronze, silver, gold, total_tasks, achievements_mask, streak, best_streak, last_daily "
+                "FROM users WHERE user_id = ?",
+                (user_id,)
+            )
+            user = await cursor.fetchone()
+            if not user:
+                return None
+
+            cursor = await conn.execute("SELECT skill_name FROM skills WHERE user_id = ?", (user_id,))
+            skills = {row[0] for row in await cursor.fetchall()}
+
+        return UserState(*user, skills=skills)
+
+    def _put(self, user_id, state):
+        self._states[user_id] = state
+        self._states.move_to_end(user_id)
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+            self.evictions += 1
+
+    # ---------- сквозная запись ----------
+    def apply(self, user_id, hp=0, bronze=0, silver=0, gold=0, total_tasks=0,
+              skills=(), achievements_mask=0, streak=None):
+        if user_id in self._inflight:
+            self._stale.add(user_id)
+        state = self._states.get(user_id)
+        if state is None:
+            return
+        state.hp += hp
+        state.bronze += bronze
+        state.silver += silver
+        state.gold += gold
+        state.total_tasks += total_tasks
+        state.achievements_mask |= achievements_mask
+        state.skills.update(skills)
+        # Серия не дельта: (серия, рекорд, последний день) из RETURNING
+        if streak is not None:
+            state.streak, state.best_streak, state.last_daily = streak
+
+    def invalidate(self, user_id):
+        if user_id in self._inflight:
+            self._stale.add(user_id)
+        self._states.pop(user_id, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._states),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+user_cache = UserCache()
@@ -0,0 +1,75 @@
+import os
+from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from db import db
+
+# ========== НАСТРОЙКИ ==========
+DEFAULT_TZ = os.getenv("DEFAULT_TZ", "Europe/Minsk")
+
+
+# ==================== ЧАСОВЫЕ ПОЯСА ====================
+@lru_cache(maxsize=None)
+def get_zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TZ)
+
+
+def is_valid_zone(name):
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def next_midnight(name, now):
+    # Ближайшая полночь в поясе name, в UTC
+    zone = get_zone(name)
+    local = now.astimezone(zone)
+    midnight = datetime.combine(local.date() + timedelta(days=1), time(), tzinfo=zone)
+    return midnight.astimezone(timezone.utc)
+
+
+# ==================== ЧАСЫ ПОЛЬЗОВАТЕЛЯ ====================
+class UserClock:
+    # Единственный источник «сегодня» для квестов, сводок и серий: день
+    # пользователя меняется в его полночь, а не в полночь сервера. В памяти
+    # только пояса, отличные от DEFAULT_TZ, — обычно их немного. Пояс
+    # меняется только через /tz, который вызывает set_zone().
+
+    def __init__(self, database=db):
+        self.db = database
+        self._zones = {}
+
+    async def load(self):
+        rows = await self.db.fetchall(
+            "SELECT user_id, tz FROM users WHERE tz IS NOT NULL AND tz != ?", (DEFAULT_TZ,)
+        )
+        self._zones = {user_id: tz for user_id, tz in rows}
+
+    def set_zone(self, user_id, tz):
+        if tz == DEFAULT_TZ:
+            self._zones.pop(user_id, None)
+        else:
+            self._zones[user_id] = tz
+
+    def zone_name(self, user_id):
+        return self._zones.get(user_id, DEFAULT_TZ)
+
+    def now(self, user_id):
+        return datetime.now(get_zone(self.zone_name(user_id)))
+
+    def today(self, user_id):
+        return self.now(user_id).date()
+
+    def date_of(self, user_id, stamp):
+        # День пользователя для отметки времени из базы (ISO); отметки без
+        # пояса записаны по часам сервера
+        return datetime.fromisoformat(stamp).astimezone(get_zone(self.zone_name(user_id))).date()
+
+
+clock = UserClock()
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from clock import DEFAULT_TZ, get_zone, next_midnight
+from db import db
+from quests import rollover
+
+# ========== НАСТРОЙКИ ==========
+# Пауза после полуночи пояса перед сменой дня
+ROLLOVER_DELAY = timedelta(seconds=5)
+# Не спать дольше этого: пояс, впервые выбранный через /tz, подхватывается
+# не позже чем через час
+DAY_CHECK_INTERVAL = float(os.getenv("DAY_CHECK_INTERVAL", "3600"))
+# Сколько пользователей обнулять одной операцией записи
+SETTLE_BATCH_USERS = 5000
+
+log = logging.getLogger(__name__)
+
+
+# ==================== СЕРИИ ====================
+# users.streak — сколько дней подряд (по часам пользователя) выполнена
+# хотя бы одна цель или квест, users.last_daily — последний такой день,
+# users.best_streak — рекорд. Серия продлевается в той же операции
+# записи, что и награда; обнуление пропустивших — пакетно в конце дня.
+
+_NEXT_STREAK = "CASE WHEN last_daily = ? THEN streak WHEN last_daily = ? THEN streak + 1 ELSE 1 END"
+
+
+async def touch_streak(conn, user_id, day):
+    # day — сегодняшний date пользователя (clock.today); возвращает
+    # (серия, рекорд, последний день) для кэша
+    today = day.isoformat()
+    yesterday = (day - timedelta(days=1)).isoformat()
+    cursor = await conn.execute(
+        f"UPDATE users SET streak = {_NEXT_STREAK}, best_streak = MAX(best_streak, {_NEXT_STREAK}), last_daily = ? "
+        "WHERE user_id = ? RETURNING streak, best_streak, last_daily",
+        (today, yesterday, today, yesterday, today, user_id)
+    )
+    row = await cursor.fetchone()
+    return tuple(row) if row else None
+
+
+def current_streak(streak, last_daily, today):
+    # Серия, пропустившая вчерашний день, уже прервана — даже если пакетное
+    # обнуление её пояса ещё не прошло (или прошло в другом процессе)
+    if not last_daily or last_daily < (today - timedelta(days=1)).isoformat():
+        return 0
+    return streak
+
+
+async def settle_streaks(zone, day, database=db):
+    # Обнуляет серии пояса zone, не продлённые вчера (день day уже начался)
+    yesterday = (day - timedelta(days=1)).isoformat()
+
+    async def op(conn):
+        cursor = await conn.execute(
+            "UPDATE users SET streak = 0 WHERE rowid IN ("
+            "SELECT rowid FROM users WHERE streak > 0 AND (last_daily IS NULL OR last_daily < ?) "
+            "AND COALESCE(tz, ?) = ? LIMIT ?)",
+            (yesterday, DEFAULT_TZ, zone, SETTLE_BATCH_USERS)
+        )
+        return cursor.rowcount
+
+    total = 0
+    while True:
+        settled = await database.run(op)
+        total += settled
+        if settled < SETTLE_BATCH_USERS:
+            return total
+
+
+# ==================== КОНЕЦ ДНЯ ====================
+async def bucket_zones(database=db):
+    # Пояса, в которых есть пользователи; DEFAULT_TZ — всегда
+    rows = await database.fetchall("SELECT DISTINCT tz FROM users WHERE tz IS NOT NULL")
+    return sorted({DEFAULT_TZ} | {row[0] for row in rows})
+
+
+async def end_of_day(zone, day):
+    # Один проход на пояс: серии и квесты всех его пользователей разом
+    settled = await settle_streaks(zone, day)
+    if settled:
+        log.info("Прерванных серий в %s: %d", zone, settled)
+    await rollover(day.isoformat(), zone)
+
+
+async def end_of_day_loop():
+    # Первый проход по всем поясам — сразу при старте: догоняем пропущенные
+    # полуночи. Дальше спим до ближайшей полуночи среди поясов.
+    done = {}
+    while True:
+        zones = await bucket_zones()
+        now = datetime.now(timezone.utc)
+        for zone in zones:
+            day = now.astimezone(get_zone(zone)).date()
+            if done.get(zone) == day:
+                continue
+            try:
+                await end_of_day(zone, day)
+                done[zone] = day
+            except Exception:
+                log.exception("Ошибка при смене дня в поясе %s", zone)
+        now = datetime.now(timezone.utc)
+        wake = min(next_midnight(zone, now) for zone in zones) + ROLLOVER_DELAY
+        await asyncio.sleep(min(max((wake - now).total_seconds(), 1.0), DAY_CHECK_INTERVAL))
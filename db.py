@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+# ========== НАСТРОЙКИ ==========
+DB_PATH = os.getenv("DB_PATH", "game_bot.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+# Размер кэша подготовленных выражений sqlite3 на каждое соединение:
+# все запросы бота — константные строки, поэтому повторно они не парсятся
+DB_STATEMENT_CACHE = 256
+# Окно групповой фиксации: записи, пришедшие за это время, коммитятся одной
+# транзакцией (и одним fsync), поэтому полная синхронность нам по карману
+DB_BATCH_WINDOW_MS = float(os.getenv("DB_BATCH_WINDOW_MS", "2"))
+DB_BATCH_MAX = int(os.getenv("DB_BATCH_MAX", "256"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "FULL")
+
+PRAGMAS = (
+    # Действует только для новой базы (до первой таблицы); существующую
+    # переводит разовый `python maintenance.py vacuum`
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA synchronous = {DB_SYNCHRONOUS}",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+log = logging.getLogger(__name__)
+
+
+# ==================== ЗАМЕР ЗАПРОСОВ ====================
+class TimedConnection:
+    # Обёртка над соединением aiosqlite: время каждого execute/executemany
+    # уходит в database.on_query(sql, секунды), если он задан. Остальное
+    # (commit, rollback, close...) проксируется как есть. Измеряется вызов
+    # execute, т.е. подготовка и первый шаг выражения; дочитывание курсора
+    # в замер не входит.
+
+    def __init__(self, conn, database):
+        self._conn = conn
+        self._db = database
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, sql, parameters=None):
+        return TimedResult(self._conn.execute(sql, parameters), sql, self._db)
+
+    def executemany(self, sql, parameters):
+        return TimedResult(self._conn.executemany(sql, parameters), sql, self._db)
+
+
+class TimedResult:
+    # Как и результат aiosqlite: можно await-ить или использовать в async with
+    __slots__ = ("_result", "_sql", "_db", "_cursor")
+
+    def __init__(self, result, sql, database):
+        self._result = result
+        self._sql = sql
+        self._db = database
+        self._cursor = None
+
+    async def _timed(self):
+        observe = self._db.on_query
+        if observe is None:
+            return await self._result
+        started = time.perf_counter()
+        try:
+            return await self._result
+        finally:
+            observe(self._sql, time.perf_counter() - started)
+
+    def __await__(self):
+        return self._timed().__await__()
+
+    async def __aenter__(self):
+        self._cursor = await self
+        return self._cursor
+
+    async def __aexit__(self, *exc):
+        await self._cursor.close()
+
+
+# ==================== ПУЛ СОЕДИНЕНИЙ ====================
+class Database:
+    # Долгоживущие соединения: пул читателей и одно соединение-писатель.
+    # В WAL читатели не блокируют писателя, а SQLite всё равно допускает
+    # только одного писателя, поэтому записи сериализуются через замок.
+
+    def __init__(self, path=DB_PATH, pool_size=DB_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._readers = []
+        self._pool = None
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._queue = None
+        self._flusher = None
+        # Необязательный наблюдатель запросов: on_query(sql, секунды)
+        self.on_query = None
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(
+            self.path,
+            isolation_level=None,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        return TimedConnection(conn, self)
+
+    async def open(self):
+        if self.is_open:
+            return
+        # Писатель открывается первым: он переводит файл в WAL
+        self._writer = await self._connect()
+        self._pool = asyncio.Queue()
+        for _ in range(self.pool_size):
+            conn = await self._connect()
+            await conn.execute("PRAGMA query_only = ON")
+            self._readers.append(conn)
+            self._pool.put_nowait(conn)
+        self._queue = asyncio.Queue()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        log.info("База %s открыта: %d читателей + писатель", self.path, self.pool_size)
+
+    async def close(self):
+        if not self.is_open:
+            return
+        # Сначала дописываем всё, что уже стоит в очереди
+        self._queue.put_nowait(None)
+        await self._flusher
+        self._flusher = None
+        async with self._write_lock:
+            try:
+                await self._writer.execute("PRAGMA optimize")
+                await self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except aiosqlite.Error:
+                log.exception("Не удалось выполнить checkpoint при закрытии")
+            for conn in self._readers:
+                await conn.close()
+            await self._writer.close()
+            self._readers = []
+            self._pool = None
+            self._writer = None
+        log.info("База %s закрыта", self.path)
+
+    # ---------- чтение ----------
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put_nowait(conn)
+
+    async def fetchone(self, sql, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql, params=()):
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    # ---------- запись ----------
+    @asynccontextmanager
+    async def transaction(self):
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    async def run(self, op):
+        # op(conn) выполняется внутри общей пакетной транзакции под своим
+        # SAVEPOINT; результат возвращается только после COMMIT пакета
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, future))
+        return await future
+
+    async def execute(self, sql, params=()):
+        async def op(conn):
+            cursor = await conn.execute(sql, params)
+            return cursor.rowcount
+        return await self.run(op)
+
+    async def executemany(self, sql, seq_of_params):
+        async def op(conn):
+            await conn.executemany(sql, seq_of_params)
+        return await self.run(op)
+
+    # ---------- групповая фиксация ----------
+    async def _flush_loop(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            if DB_BATCH_WINDOW_MS > 0:
+                await asyncio.sleep(DB_BATCH_WINDOW_MS / 1000)
+            while len(batch) < DB_BATCH_MAX and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch):
+        results = []
+        async with self._write_lock:
+            conn = self._writer
+            try:
+                await conn.execute("BEGIN IMMEDIATE")
+                for op, future in batch:
+                    if future.cancelled():
+                        continue
+                    await conn.execute("SAVEPOINT op")
+                    try:
+                        result = await op(conn)
+                    except Exception as e:
+                        # Ошибка одной операции откатывает только её
+                        await conn.execute("ROLLBACK TO op")
+                        await conn.execute("RELEASE op")
+                        results.append((future, e, None))
+                    else:
+                        await conn.execute("RELEASE op")
+                        results.append((future, None, result))
+                await conn.commit()
+            except Exception as e:
+                log.exception("Пакет из %d записей не зафиксирован", len(batch))
+                if conn.in_transaction:
+                    await conn.rollback()
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        for future, error, result in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+db = Database()
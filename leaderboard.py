@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import random
+
+from db import db
+
+# ========== НАСТРОЙКИ ==========
+LEADERBOARD_TOP = int(os.getenv("LEADERBOARD_TOP", "10"))
+# Как часто перечитывать рейтинг из базы, когда процессов несколько
+LEADERBOARD_REFRESH = float(os.getenv("LEADERBOARD_REFRESH", "300"))
+
+log = logging.getLogger(__name__)
+
+
+# ==================== ДЕКАРТОВО ДЕРЕВО ====================
+class _Node:
+    __slots__ = ("key", "priority", "left", "right", "size")
+
+    def __init__(self, key, priority):
+        self.key = key
+        self.priority = priority
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node, key):
+    # (ключи < key, ключи >= key)
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        _update(node)
+        return node, right
+    left, node.left = _split(node.left, key)
+    _update(node)
+    return left, node
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _erase(node, key):
+    if node is None:
+        return None
+    if node.key == key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _erase(node.left, key)
+    else:
+        node.right = _erase(node.right, key)
+    _update(node)
+    return node
+
+
+class OrderStatisticTree:
+    # Декартово дерево с размерами поддеревьев: вставка, удаление и
+    # позиция ключа за O(log n) в среднем
+
+    def __init__(self, keys=()):
+        self.root = self._build(sorted(keys))
+
+    @staticmethod
+    def _build(keys):
+        # Построение из отсортированных ключей за O(n): стек правой ветви
+        stack = []
+        for key in keys:
+            node = _Node(key, random.random())
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+                _update(last)
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+        for node in reversed(stack):
+            _update(node)
+        return stack[0] if stack else None
+
+    def __len__(self):
+        return _size(self.root)
+
+    def insert(self, key):
+        left, right = _split(self.root, key)
+        self.root = _merge(_merge(left, _Node(key, random.random())), right)
+
+    def remove(self, key):
+        self.root = _erase(self.root, key)
+
+    def count_less(self, key):
+        count = 0
+        node = self.root
+        while node is not None:
+            if node.key < key:
+                count += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    def first(self, n):
+        # Первые n ключей по порядку (обход без рекурсии)
+        result = []
+        stack = []
+        node = self.root
+        while (stack or node is not None) and len(result) < n:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append(node.key)
+            node = node.right
+        return result
+
+
+# ==================== РЕЙТИНГ ====================
+class Leaderboard:
+    # Ключ игрока — (-hp, -total_tasks, user_id): меньший ключ выше в рейтинге.
+    # Заполняется из users при старте и дальше обновляется дельтами вместе с
+    # кэшем пользователей (сначала коммит, затем apply).
+
+    def __init__(self, database=db):
+        self.db = database
+        self._tree = OrderStatisticTree()
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._scores)
+
+    @staticmethod
+    def _key(user_id, hp, total_tasks):
+        return -hp, -total_tasks, user_id
+
+    async def load(self):
+        rows = await self.db.fetchall("SELECT user_id, hp, total_tasks FROM users")
+        self._scores = {user_id: (hp or 0, total_tasks or 0) for user_id, hp, total_tasks in rows}
+        self._tree = OrderStatisticTree(self._key(u, *score) for u, score in self._scores.items())
+        log.info("Рейтинг загружен: %d игроков", len(self._scores))
+
+    def apply(self, user_id, hp=0, total_tasks=0):
+        # Игрок, которого не было при загрузке, — новый, начинает с нуля
+        old = self._scores.get(user_id)
+        if old is not None:
+            if not hp and not total_tasks:
+                return
+            self._tree.remove(self._key(user_id, *old))
+        else:
+            old = (0, 0)
+        score = old[0] + hp, old[1] + total_tasks
+        self._scores[user_id] = score
+        self._tree.insert(self._key(user_id, *score))
+
+    def rank(self, user_id):
+        # Место игрока (с 1) или None, если его нет в рейтинге
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return self._tree.count_less(self._key(user_id, *score)) + 1
+
+    def top(self, n=LEADERBOARD_TOP):
+        # [(user_id, hp, total_tasks), ...]
+        return [(user_id, -hp, -total_tasks) for hp, total_tasks, user_id in self._tree.first(n)]
+
+    async def refresh_loop(self, interval=LEADERBOARD_REFRESH):
+        # При шардировании процесс видит дельты только своих пользователей —
+        # остальных подтягиваем периодическим перечитыванием
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception:
+                log.exception("Не удалось перечитать рейтинг")
+
+
+leaderboard = Leaderboard()
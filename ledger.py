@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from db import db
+
+# ========== НАСТРОЙКИ ==========
+# Как часто обновлять снимки балансов (секунды)
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "3600"))
+LEDGER_HISTORY_SIZE = 15
+
+# Источники движений
+SOURCE_OPENING = "opening"
+SOURCE_TASK = "task"
+SOURCE_QUEST = "quest"
+SOURCE_ACHIEVEMENT = "achievement"
+SOURCE_PURCHASE = "purchase"
+
+SOURCE_TITLES = {
+    SOURCE_OPENING: "💼 Начальный баланс",
+    SOURCE_TASK: "🎯 Цель",
+    SOURCE_QUEST: "📋 Квест",
+    SOURCE_ACHIEVEMENT: "🏆 Достижение",
+    SOURCE_PURCHASE: "🛒 Покупка",
+}
+
+log = logging.getLogger(__name__)
+
+
+# ==================== ЗАПИСЬ ====================
+# Журнал только дополняется. Балансы в users — его материализованная сумма:
+# каждое изменение баланса пишет строку журнала в той же операции записи
+# (том же SAVEPOINT), что и UPDATE users, поэтому они не расходятся.
+
+async def record_many(conn, user_id, entries):
+    # entries: [(источник, ссылка, (hp, бронза, серебро, золото)), ...]
+    if not entries:
+        return
+    ts = datetime.now().isoformat(timespec="seconds")
+    placeholders = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?)"] * len(entries))
+    params = []
+    for source, ref, (hp, bronze, silver, gold) in entries:
+        params += [user_id, ts, source, ref, hp, bronze, silver, gold]
+    await conn.execute(
+        f"INSERT INTO ledger (user_id, ts, source, ref, hp, bronze, silver, gold) VALUES {placeholders}",
+        params
+    )
+
+
+async def record(conn, user_id, source, delta, ref=None):
+    await record_many(conn, user_id, [(source, ref, delta)])
+
+
+# ==================== ЧТЕНИЕ ====================
+async def history(user_id, limit=LEDGER_HISTORY_SIZE, database=db):
+    # Последние движения — обратный обход idx_ledger_user
+    return await database.fetchall(
+        "SELECT ts, source, ref, hp, bronze, silver, gold FROM ledger WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+        (user_id, limit)
+    )
+
+
+# ==================== СНИМКИ ====================
+async def snapshot_balances(database=db):
+    # Сворачивает в balance_snapshots всё, что добавилось в журнал после
+    # прошлого снимка: снимок + новые строки. Новые строки выбираются по
+    # первичному ключу от водяного знака, т.е. стоимость — только прирост.
+    # Тут же сверяем снимки с users: расхождение — баг в экономике.
+    async def op(conn):
+        cursor = await conn.execute("SELECT COALESCE(MAX(ledger_id), 0) FROM balance_snapshots")
+        mark = (await cursor.fetchone())[0]
+        taken_at = datetime.now().isoformat(timespec="seconds")
+        cursor = await conn.execute(
+            '''
+            INSERT INTO balance_snapshots (user_id, ledger_id, hp, bronze, silver, gold, taken_at)
+            SELECT l.user_id, MAX(l.id),
+                   COALESCE(s.hp, 0) + SUM(l.hp), COALESCE(s.bronze, 0) + SUM(l.bronze),
+                   COALESCE(s.silver, 0) + SUM(l.silver), COALESCE(s.gold, 0) + SUM(l.gold), ?
+            FROM ledger l LEFT JOIN balance_snapshots s ON s.user_id = l.user_id
+            WHERE l.id > ?
+            GROUP BY l.user_id
+            ON CONFLICT (user_id) DO UPDATE SET
+                ledger_id = excluded.ledger_id, hp = excluded.hp, bronze = excluded.bronze,
+                silver = excluded.silver, gold = excluded.gold, taken_at = excluded.taken_at
+            ''',
+            (taken_at, mark)
+        )
+        updated = cursor.rowcount
+        cursor = await conn.execute(
+            '''
+            SELECT s.user_id FROM balance_snapshots s JOIN users u ON u.user_id = s.user_id
+            WHERE s.ledger_id > ?
+              AND (u.hp != s.hp OR u.bronze != s.bronze OR u.silver != s.silver OR u.gold != s.gold)
+            ''',
+            (mark,)
+        )
+        return updated, [row[0] for row in await cursor.fetchall()]
+
+    updated, mismatched = await database.run(op)
+    if mismatched:
+        log.warning("Баланс расходится с журналом у %d пользователей: %s", len(mismatched), mismatched[:20])
+    log.info("Снимки балансов обновлены: %d пользователей", updated)
+    return updated, mismatched
+
+
+async def snapshot_loop(interval=LEDGER_SNAPSHOT_INTERVAL):
+    while True:
+        try:
+            await snapshot_balances()
+        except Exception:
+            log.exception("Не удалось обновить снимки балансов")
+        await asyncio.sleep(interval)
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from aiogram.fsm.storage.base import BaseEventIsolation
+
+log = logging.getLogger(__name__)
+
+
+# ==================== БЛОКИРОВКИ ПО КЛЮЧУ ====================
+class KeyedLocks:
+    # Замок на каждый ключ (user_id). Запись живёт, пока замок кто-то держит
+    # или ждёт: последний вышедший удаляет её, так что словарь не растёт
+    # с числом когда-либо писавших пользователей.
+
+    def __init__(self):
+        self._locks = {}
+        self.contended = 0
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        elif entry[0].locked():
+            self.contended += 1
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._locks.get(key) is entry:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+# ==================== ИЗОЛЯЦИЯ СОБЫТИЙ ====================
+class UserEventIsolation(BaseEventIsolation):
+    # Обновления одного пользователя обрабатываются по очереди, разных —
+    # параллельно. Передаётся в Dispatcher(events_isolation=...): замок
+    # берёт встроенный FSMContextMiddleware до чтения состояния, поэтому
+    # следующее обновление маршрутизируется уже по состоянию, которое
+    # оставило предыдущее. Ключ — пользователь, а не пара чат/пользователь.
+
+    def __init__(self, locks=None):
+        self.locks = locks if locks is not None else KeyedLocks()
+
+    @asynccontextmanager
+    async def lock(self, key):
+        async with self.locks.hold(key.user_id):
+            yield
+
+    async def close(self):
+        pass
@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import aiosqlite
+
+from db import db
+
+# ========== НАСТРОЙКИ ==========
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# Резервная копия идёт шагами по BACKUP_PAGES страниц с паузой между ними
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.01"))
+# Ночное обслуживание (чистка, вакуум, копия) — в этот час по серверу
+MAINTENANCE_HOUR = int(os.getenv("MAINTENANCE_HOUR", "4"))
+# Сколько дней хранить daily_quests_archive; 0 — бессрочно
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "365"))
+# Сколько строк удалять и сколько страниц освобождать одной операцией записи
+COMPACT_BATCH_ROWS = 5000
+VACUUM_STEP_PAGES = 512
+EXPORT_BATCH_USERS = 500
+
+# Таблицы с данными пользователя (ключ user_id) — для экспорта и импорта
+USER_TABLES = (
+    "tasks", "skills", "achievements", "daily_quests", "daily_quests_archive",
+    "reminders", "ledger", "balance_snapshots", "daily_stats",
+)
+
+log = logging.getLogger(__name__)
+
+
+# ==================== РЕЗЕРВНАЯ КОПИЯ ====================
+def _backup_file(source_path, target_path, pages, sleep):
+    # Отдельное соединение держит читающую транзакцию: в WAL это снимок, и
+    # параллельные записи бота не перезапускают копирование. Между шагами
+    # sqlite3 спит sleep секунд; писатель бота всё это время не блокируется.
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, sleep=sleep)
+        source.execute("ROLLBACK")
+        # Копия — один самодостаточный файл, без -wal
+        target.execute("PRAGMA journal_mode = DELETE")
+        ok = target.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+    if ok != "ok":
+        raise RuntimeError(f"Копия {target_path} не прошла quick_check: {ok}")
+
+
+async def backup(target_path=None, database=db, pages=BACKUP_PAGES, sleep=BACKUP_STEP_SLEEP):
+    if target_path is None:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        name = os.path.splitext(os.path.basename(database.path))[0]
+        target_path = os.path.join(BACKUP_DIR, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.db")
+    partial = target_path + ".part"
+    started = datetime.now()
+    await asyncio.to_thread(_backup_file, database.path, partial, pages, sleep)
+    os.replace(partial, target_path)
+    log.info("Резервная копия %s готова за %.1f с", target_path, (datetime.now() - started).total_seconds())
+    return target_path
+
+
+def rotate_backups(keep=BACKUP_KEEP, directory=BACKUP_DIR):
+    files = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".db")
+    )
+    for path in files[:-keep] if keep > 0 else []:
+        os.remove(path)
+        log.info("Удалена старая копия %s", path)
+
+
+# ==================== УПЛОТНЕНИЕ ====================
+async def prune_archive(day, database=db):
+    # Старые строки архива квестов — порциями, чтобы не держать писателя
+    if not ARCHIVE_RETENTION_DAYS:
+        return 0
+    cutoff = (datetime.fromisoformat(day) - timedelta(days=ARCHIVE_RETENTION_DAYS)).date().isoformat()
+
+    async def op(conn):
+        cursor = await conn.execute(
+            "DELETE FROM daily_quests_archive WHERE rowid IN "
+            "(SELECT rowid FROM daily_quests_archive WHERE date < ? LIMIT ?)",
+            (cutoff, COMPACT_BATCH_ROWS)
+        )
+        return cursor.rowcount
+
+    total = 0
+    while True:
+        deleted = await database.run(op)
+        total += deleted
+        if deleted < COMPACT_BATCH_ROWS:
+            return total
+
+
+async def incremental_vacuum(database=db, step=VACUUM_STEP_PAGES):
+    # Возвращает свободные страницы ОС по step за операцию записи. Работает
+    # только при auto_vacuum = INCREMENTAL (см. enable_incremental_vacuum)
+    mode = (await database.fetchone("PRAGMA auto_vacuum"))[0]
+    if mode != 2:
+        log.info("auto_vacuum не INCREMENTAL — пропускаем; один раз: python maintenance.py vacuum")
+        return 0
+
+    async def op(conn):
+        # Страницы освобождаются по мере чтения строк результата
+        cursor = await conn.execute(f"PRAGMA incremental_vacuum({step})")
+        await cursor.fetchall()
+        cursor = await conn.execute("PRAGMA freelist_count")
+        return (await cursor.fetchone())[0]
+
+    before = (await database.fetchone("PRAGMA freelist_count"))[0]
+    left = before
+    while left:
+        left = await database.run(op)
+    if before:
+        log.info("Инкрементальный вакуум: освобождено страниц: %d", before)
+    return before
+
+
+async def enable_incremental_vacuum(path):
+    # Разовая операция без бота: режим auto_vacuum вступает в силу только
+    # после полного VACUUM, который переписывает весь файл
+    async with aiosqlite.connect(path, isolation_level=None) as conn:
+        await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await conn.execute("VACUUM")
+    log.info("%s: auto_vacuum = INCREMENTAL", path)
+
+
+async def nightly(database=db):
+    day = datetime.now().date().isoformat()
+    pruned = await prune_archive(day, database)
+    if pruned:
+        log.info("Из архива квестов удалено строк: %d", pruned)
+    await incremental_vacuum(database)
+    await backup(database=database)
+    rotate_backups()
+
+
+async def maintenance_loop():
+    while True:
+        now = datetime.now()
+        at = now.replace(hour=MAINTENANCE_HOUR, minute=0, second=0, microsecond=0)
+        if at <= now:
+            at += timedelta(days=1)
+        await asyncio.sleep((at - now).total_seconds())
+        try:
+            await nightly()
+        except Exception:
+            log.exception("Ошибка ночного обслуживания базы")
+
+
+# ==================== ЭКСПОРТ / ИМПОРТ ====================
+EXPORT_USERS_PAGE = "SELECT * FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?"
+# Строки таблицы из USER_TABLES для пачки пользователей и удаление строк
+# одного пользователя; у каждой таблицы есть индекс, начинающийся с user_id
+EXPORT_USER_ROWS = "SELECT * FROM {table} WHERE user_id IN ({placeholders})"
+IMPORT_DELETE_USER_ROWS = "DELETE FROM {table} WHERE user_id = ?"
+
+
+def _rows_as_dicts(cursor, rows):
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+async def export_jsonl(out, database=db, batch=EXPORT_BATCH_USERS):
+    # Строка на пользователя: {"user": {...}, "tasks": [...], ...}. Читаем
+    # отдельным соединением в одной транзакции (согласованный снимок) и
+    # пачками по batch пользователей — память не зависит от размера базы.
+    count = 0
+    async with aiosqlite.connect(database.path, isolation_level=None) as conn:
+        await conn.execute("BEGIN")
+        try:
+            # Граница — по первичному ключу: каждая пачка ищется по индексу,
+            # а не сканом с начала таблицы
+            cursor = await conn.execute("SELECT MIN(user_id) - 1 FROM users")
+            last = (await cursor.fetchone())[0]
+            while last is not None:
+                cursor = await conn.execute(EXPORT_USERS_PAGE, (last, batch))
+                users = _rows_as_dicts(cursor, await cursor.fetchall())
+                if not users:
+                    break
+                ids = [u["user_id"] for u in users]
+                placeholders = ", ".join("?" * len(ids))
+                related = {u["user_id"]: {"user": u} for u in users}
+                for table in USER_TABLES:
+                    cursor = await conn.execute(EXPORT_USER_ROWS.format(table=table, placeholders=placeholders), ids)
+                    for row in _rows_as_dicts(cursor, await cursor.fetchall()):
+                        related[row["user_id"]].setdefault(table, []).append(row)
+                for user_id in ids:
+                    out.write(json.dumps(related[user_id], ensure_ascii=False) + "\n")
+                count += len(ids)
+                last = ids[-1]
+        finally:
+            await conn.execute("ROLLBACK")
+    log.info("Экспортировано пользователей: %d", count)
+    return count
+
+
+async def _columns(database, table):
+    rows = await database.fetchall(f"PRAGMA table_info({table})")
+    return {row[1] for row in rows}
+
+
+async def import_jsonl(lines, database=db, batch=EXPORT_BATCH_USERS):
+    # Данные пользователя заменяются целиком: строки из файла вместо
+    # существующих. Пачка пользователей — одна операция записи. Ключи
+    # сверяются со схемой, неизвестные колонки отбрасываются.
+    allowed = {table: await _columns(database, table) for table in ("users",) + USER_TABLES}
+
+    def insert(conn, table, row):
+        columns = [c for c in row if c in allowed[table]]
+        return conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [row[c] for c in columns]
+        )
+
+    async def write(records):
+        async def op(conn):
+            for record in records:
+                user = record["user"]
+                user_id = user["user_id"]
+                for table in USER_TABLES:
+                    await conn.execute(IMPORT_DELETE_USER_ROWS.format(table=table), (user_id,))
+                await conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+                await insert(conn, "users", user)
+                for table in USER_TABLES:
+                    for row in record.get(table, ()):
+                        await insert(conn, table, row)
+        await database.run(op)
+
+    count = 0
+    pending = []
+    for line in lines:
+        if not line.strip():
+            continue
+        pending.append(json.loads(line))
+        if len(pending) >= batch:
+            await write(pending)
+            count += len(pending)
+            pending = []
+    if pending:
+        await write(pending)
+        count += len(pending)
+    log.info("Импортировано пользователей: %d", count)
+    return count
+
+
+# ==================== ЗАПУСК ИЗ КОНСОЛИ ====================
+# python maintenance.py backup [файл]
+# python maintenance.py export users.jsonl
+# python maintenance.py import users.jsonl   (бот в это время не должен
+#                                              работать с базой: его кэши не узнают о замене)
+# python maintenance.py vacuum               (разово, при остановленном боте)
+async def cli(args):
+    if args.command == "vacuum":
+        await enable_incremental_vacuum(db.path)
+        return
+
+    from migrations import migrate
+
+    await db.open()
+    try:
+        if args.command == "backup":
+            await backup(args.path)
+        elif args.command == "export":
+            with open(args.path, "w", encoding="utf-8") as f:
+                await export_jsonl(f)
+        elif args.command == "import":
+            await migrate()
+            with open(args.path, encoding="utf-8") as f:
+                await import_jsonl(f)
+        elif args.command == "compact":
+            await prune_archive(datetime.now().date().isoformat())
+            await incremental_vacuum()
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание базы LifeRPG-бота")
+    parser.add_argument("command", choices=("backup", "export", "import", "compact", "vacuum"))
+    parser.add_argument("path", nargs="?")
+    arguments = parser.parse_args()
+    if arguments.command in ("export", "import") and not arguments.path:
+        parser.error("нужен путь к файлу JSONL")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(cli(arguments))
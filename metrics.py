@@ -0,0 +1,210 @@
+import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+# ========== НАСТРОЙКИ ==========
+# Страница /metrics в текстовом формате Prometheus; 0 — не поднимать
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+
+# Границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+log = logging.getLogger(__name__)
+
+
+# ==================== РЕЕСТР ====================
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metrics:
+    # Счётчики и гистограммы в памяти процесса; метки — кортеж пар
+    # (имя, значение). Значения, которые и так где-то считаются (кэш,
+    # ограничитель отправки), не дублируются: их снимают сборщики при
+    # каждом запросе /metrics.
+
+    def __init__(self):
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def collector(self, func):
+        # func() -> [(имя, метки, значение), ...]
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        samples = {}
+        for (name, labels), value in self._counters.items():
+            samples.setdefault(name, []).append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in self._histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    samples.setdefault(name, []).append(f"{name}{_labels(labels)} {value}")
+            except Exception:
+                log.exception("Сборщик метрик %s упал", getattr(collect, "__name__", collect))
+
+        out = []
+        for name in sorted(samples):
+            kind, help_text = self._meta.get(name, ("counter" if name.endswith("_total") else "gauge", ""))
+            if help_text:
+                out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(samples[name])
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("bot_updates_seconds", "histogram", "Обработка обновления целиком, по типу")
+metrics.describe("bot_handler_seconds", "histogram", "Время хендлера")
+metrics.describe("bot_handler_errors_total", "counter", "Исключения хендлеров")
+metrics.describe("bot_db_query_seconds", "histogram", "Выполнение SQL-выражения, по форме запроса")
+metrics.describe("bot_api_requests_total", "counter", "Попытки запросов к Telegram API по методу и исходу")
+metrics.describe("bot_api_request_seconds", "histogram", "Время ответа Telegram API")
+
+
+# ==================== ОБНОВЛЕНИЯ И ХЕНДЛЕРЫ ====================
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # Outer-middleware на update: полное время обновления, включая фильтры,
+    # FSM и ожидание замка пользователя
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.observe("bot_updates_seconds", (("type", event.event_type),), time.perf_counter() - started)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Имя хендлера известно только после фильтров, поэтому это
+    # inner-middleware: регистрируется на каждом типе событий
+    async def __call__(self, handler, event, data):
+        labels = (("handler", data["handler"].callback.__name__),)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            metrics.inc("bot_handler_errors_total", labels + (("error", type(e).__name__),))
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", labels, time.perf_counter() - started)
+
+
+def instrument_dispatcher(dp):
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_metrics = HandlerMetricsMiddleware()
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(handler_metrics)
+
+
+# ==================== БАЗА ====================
+_PLACEHOLDERS = re.compile(r"\?(\s*,\s*\?)+")
+_ROWS = re.compile(r"\(\?…\)(\s*,\s*\(\?…\))+")
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(sql):
+    # Многострочные VALUES и IN (...) дают разный текст при разном числе
+    # строк — сворачиваем списки плейсхолдеров, чтобы форма была одна
+    shape = " ".join(sql.split())
+    shape = _PLACEHOLDERS.sub("?…", shape)
+    return _ROWS.sub("(?…)…", shape)
+
+
+def observe_query(sql, seconds):
+    metrics.observe("bot_db_query_seconds", (("query", statement_shape(sql)),), seconds, QUERY_BUCKETS)
+
+
+def instrument_database(database):
+    database.on_query = observe_query
+
+
+# ==================== TELEGRAM API ====================
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    # Регистрируется в сессии после RateLimitMiddleware, т.е. внутри него:
+    # видит каждую попытку (включая повторы) без ожидания в ограничителе
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            metrics.inc("bot_api_requests_total", (("method", name), ("result", type(e).__name__)))
+            raise
+        finally:
+            metrics.observe("bot_api_request_seconds", (("method", name),), time.perf_counter() - started)
+        metrics.inc("bot_api_requests_total", (("method", name), ("result", "ok")))
+        return response
+
+
+# ==================== /metrics ====================
+async def metrics_view(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def serve_metrics(port=METRICS_PORT, host=METRICS_HOST):
+    # Отдельный маленький сервер: работает и при long polling. Возвращает
+    # runner для остановки или None, если страница выключена.
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("Метрики на http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,295 @@
+import logging
+from datetime import datetime
+
+from db import db
+
+log = logging.getLogger(__name__)
+
+# ==================== МИГРАЦИИ ====================
+# Каждая миграция — (версия, название, список SQL-выражений).
+# Список только дополняется: применённые миграции не редактируются,
+# любое изменение схемы — новая запись с очередной версией.
+MIGRATIONS = [
+    (1, "baseline", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            hp INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            bronze INTEGER DEFAULT 0,
+            silver INTEGER DEFAULT 0,
+            gold INTEGER DEFAULT 0,
+            total_tasks INTEGER DEFAULT 0,
+            last_daily TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT,
+            difficulty TEXT,
+            completed BOOLEAN DEFAULT 0,
+            date TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS skills (
+            user_id INTEGER,
+            skill_name TEXT,
+            PRIMARY KEY (user_id, skill_name)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS achievements (
+            user_id INTEGER,
+            achievement_name TEXT,
+            achieved_date TEXT,
+            PRIMARY KEY (user_id, achievement_name)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_quests (
+            user_id INTEGER,
+            quest_text TEXT,
+            completed BOOLEAN DEFAULT 0,
+            date TEXT,
+            reward_hp INTEGER,
+            reward_bronze INTEGER,
+            reward_silver INTEGER,
+            reward_gold INTEGER
+        )
+        ''',
+    ]),
+    (2, "indexes and daily_quests key", [
+        # Открытые цели пользователя: частичный индекс только по completed = 0
+        '''
+        CREATE INDEX IF NOT EXISTS idx_tasks_user_open
+        ON tasks (user_id, id) WHERE completed = 0
+        ''',
+        # daily_quests получает ключ (user_id, date, slot): slot — номер квеста
+        # в дне, он же индекс кнопки. Ключ заодно покрывает выборку за день.
+        '''
+        CREATE TABLE daily_quests_new (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            quest_text TEXT,
+            completed BOOLEAN DEFAULT 0,
+            reward_hp INTEGER,
+            reward_bronze INTEGER,
+            reward_silver INTEGER,
+            reward_gold INTEGER,
+            PRIMARY KEY (user_id, date, slot)
+        )
+        ''',
+        '''
+        INSERT INTO daily_quests_new
+            (user_id, date, slot, quest_text, completed, reward_hp, reward_bronze, reward_silver, reward_gold)
+        SELECT user_id, date,
+               ROW_NUMBER() OVER (PARTITION BY user_id, date ORDER BY rowid) - 1,
+               quest_text, completed, reward_hp, reward_bronze, reward_silver, reward_gold
+        FROM daily_quests
+        WHERE user_id IS NOT NULL AND date IS NOT NULL
+        ''',
+        "DROP TABLE daily_quests",
+        "ALTER TABLE daily_quests_new RENAME TO daily_quests",
+    ]),
+    (3, "achievements bitmask", [
+        # Биты совпадают с Achievement.bit в achievements.py
+        "ALTER TABLE users ADD COLUMN achievements_mask INTEGER NOT NULL DEFAULT 0",
+        '''
+        UPDATE users SET achievements_mask = (
+            SELECT COALESCE(SUM(CASE achievement_name
+                WHEN '💪 Новичок' THEN 1
+                WHEN '🔥 Труженик' THEN 2
+                WHEN '🏆 Мастер' THEN 4
+                WHEN '⭐️ Легенда' THEN 8
+                WHEN '📈 Уровень 5' THEN 16
+                WHEN '📈 Уровень 10' THEN 32
+                WHEN '❤️ 1000 HP' THEN 64
+                ELSE 0 END), 0)
+            FROM achievements a WHERE a.user_id = users.user_id
+        )
+        ''',
+    ]),
+    (4, "daily quests rollover and retention", [
+        # Выборка активных пользователей и очистка старых квестов идут по дате
+        "CREATE INDEX IF NOT EXISTS idx_daily_quests_date ON daily_quests (date)",
+        '''
+        CREATE TABLE IF NOT EXISTS daily_quests_archive (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            quest_text TEXT,
+            completed BOOLEAN DEFAULT 0,
+            reward_hp INTEGER,
+            reward_bronze INTEGER,
+            reward_silver INTEGER,
+            reward_gold INTEGER,
+            PRIMARY KEY (user_id, date, slot)
+        )
+        ''',
+    ]),
+    (5, "reminders and user timezones", [
+        "ALTER TABLE users ADD COLUMN tz TEXT",
+        '''
+        CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            weekdays INTEGER NOT NULL DEFAULT 127,
+            text TEXT NOT NULL,
+            enabled BOOLEAN NOT NULL DEFAULT 1,
+            last_fired TEXT
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_reminders_user ON reminders (user_id)",
+        # Расписание, раньше зашитое в scheduled_notifications.
+        # weekdays — битовая маска, пн = 1, вт = 2, ... вс = 64
+        "INSERT OR IGNORE INTO users (user_id, tz) VALUES (1484297802, 'Europe/Minsk')",
+        '''
+        INSERT INTO reminders (user_id, hour, minute, weekdays, text) VALUES
+            (1484297802, 7, 0, 127, '🌅 Доброе утро!
+Не бери телефон первые 10 минут.
+Ты справишься сегодня 💪'),
+            (1484297802, 15, 30, 15, '📚 Время делать домашку! Убери телефон.'),
+            (1484297802, 17, 30, 11, '🧠 30 минут подготовки к ЦТ/ЦЭ. Физика или математика — погнали'),
+            (1484297802, 17, 30, 4, '💻 Через 30 минут курсы по программированию'),
+            (1484297802, 18, 0, 4, '💻 Курсы начались. Вникай 🔥'),
+            (1484297802, 18, 30, 15, '🎮 Можно отдохнуть 30 минут — но без экрана лучше'),
+            (1484297802, 19, 0, 127, '🎮 Отдыхай! Ты сегодня молодец.'),
+            (1484297802, 15, 30, 16, '🧠 Через 30 минут репетитор. Соберись'),
+            (1484297802, 16, 0, 16, '🧠 Репетитор по информатике — не опоздай'),
+            (1484297802, 11, 0, 96, '🌿 Выходной, но час физики/математики не помешает.')
+        ''',
+    ]),
+    (6, "fsm storage", [
+        '''
+        CREATE TABLE IF NOT EXISTS fsm (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm (updated_at)",
+    ]),
+    (7, "user names for the leaderboard", [
+        "ALTER TABLE users ADD COLUMN name TEXT",
+    ]),
+    (8, "currency ledger", [
+        '''
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            ts TEXT NOT NULL,
+            source TEXT NOT NULL,
+            ref TEXT,
+            hp INTEGER NOT NULL DEFAULT 0,
+            bronze INTEGER NOT NULL DEFAULT 0,
+            silver INTEGER NOT NULL DEFAULT 0,
+            gold INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, id)",
+        '''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            user_id INTEGER PRIMARY KEY,
+            ledger_id INTEGER NOT NULL,
+            hp INTEGER NOT NULL,
+            bronze INTEGER NOT NULL,
+            silver INTEGER NOT NULL,
+            gold INTEGER NOT NULL,
+            taken_at TEXT NOT NULL
+        )
+        ''',
+        # История до журнала неизвестна: текущие балансы — начальная запись,
+        # чтобы сумма журнала с первого дня совпадала с users
+        '''
+        INSERT INTO ledger (user_id, ts, source, hp, bronze, silver, gold)
+        SELECT user_id, strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime'), 'opening',
+               COALESCE(hp, 0), COALESCE(bronze, 0), COALESCE(silver, 0), COALESCE(gold, 0)
+        FROM users
+        WHERE COALESCE(hp, 0) != 0 OR COALESCE(bronze, 0) != 0 OR COALESCE(silver, 0) != 0 OR COALESCE(gold, 0) != 0
+        ''',
+    ]),
+    (9, "task timestamps and daily stats", [
+        "ALTER TABLE tasks ADD COLUMN created_at TEXT",
+        "ALTER TABLE tasks ADD COLUMN completed_at TEXT",
+        '''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            tasks_easy INTEGER NOT NULL DEFAULT 0,
+            tasks_medium INTEGER NOT NULL DEFAULT 0,
+            tasks_hard INTEGER NOT NULL DEFAULT 0,
+            quests INTEGER NOT NULL DEFAULT 0,
+            hp INTEGER NOT NULL DEFAULT 0,
+            bronze INTEGER NOT NULL DEFAULT 0,
+            silver INTEGER NOT NULL DEFAULT 0,
+            gold INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (10, "streaks", [
+        "ALTER TABLE users ADD COLUMN streak INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE users ADD COLUMN best_streak INTEGER NOT NULL DEFAULT 0",
+        # Серии до этой версии восстанавливаются по daily_stats: подряд
+        # идущие дни дают одинаковую разность julianday(day) - номер дня
+        '''
+        UPDATE users SET streak = s.current, best_streak = s.best, last_daily = s.last
+        FROM (
+            WITH islands AS (
+                SELECT user_id, day,
+                       julianday(day) - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day) AS grp
+                FROM daily_stats
+            ), runs AS (
+                SELECT user_id, COUNT(*) AS length, MAX(day) AS last FROM islands GROUP BY user_id, grp
+            )
+            SELECT user_id, MAX(length) AS best, MAX(last) AS last,
+                   (SELECT r.length FROM runs r WHERE r.user_id = runs.user_id ORDER BY r.last DESC LIMIT 1) AS current
+            FROM runs GROUP BY user_id
+        ) s
+        WHERE users.user_id = s.user_id
+        ''',
+    ]),
+    (11, "tasks index by user", [
+        # Частичный idx_tasks_user_open не годится для выборки всех целей
+        # пользователя (экспорт, импорт) — без этого индекса там скан таблицы
+        "CREATE INDEX IF NOT EXISTS idx_tasks_user ON tasks (user_id)",
+    ]),
+]
+
+
+async def migrate(database=db):
+    async with database.transaction() as conn:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TEXT
+            )
+        ''')
+        cursor = await conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = (await cursor.fetchone())[0]
+
+    latest = MIGRATIONS[-1][0]
+    if current > latest:
+        raise RuntimeError(f"Схема базы (v{current}) новее кода (v{latest})")
+
+    for version, name, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        # Каждая миграция — отдельная транзакция: при ошибке база
+        # остаётся на предыдущей версии
+        async with database.transaction() as conn:
+            for sql in statements:
+                await conn.execute(sql)
+            await conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.now().isoformat())
+            )
+        log.info("Применена миграция %d: %s", version, name)
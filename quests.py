@@ -0,0 +1,101 @@
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+
+from clock import DEFAULT_TZ
+from db import db
+
+# ========== НАСТРОЙКИ ==========
+QUESTS_PER_DAY = 3
+# Активный пользователь — выполнял цель или квест за последние N дней
+QUEST_ACTIVE_DAYS = int(os.getenv("QUEST_ACTIVE_DAYS", "7"))
+# Квесты старше N дней удаляются из daily_quests
+QUEST_RETENTION_DAYS = int(os.getenv("QUEST_RETENTION_DAYS", "30"))
+# Переносить ли удаляемые квесты в daily_quests_archive
+QUEST_ARCHIVE = os.getenv("QUEST_ARCHIVE", "0") == "1"
+# Сколько пользователей генерировать одной операцией записи
+QUEST_BATCH_USERS = 500
+
+QUESTS = [
+    ("📚 Прочитать 10 страниц книги", 20, 2, 1, 0),
+    ("🏃 Сделать зарядку", 15, 1, 1, 0),
+    ("💧 Выпить 2 литра воды", 10, 3, 0, 0),
+    ("🧠 Выучить 5 новых слов", 25, 0, 2, 1),
+    ("🧹 Убраться в комнате", 30, 2, 2, 0),
+    ("📝 Написать планы на завтра", 15, 2, 1, 0),
+    ("🎨 Позаниматься творчеством", 25, 1, 2, 1),
+    ("🧘 Помедитировать 10 минут", 20, 2, 2, 0),
+]
+
+INSERT_QUEST = (
+    "INSERT OR IGNORE INTO daily_quests (user_id, date, slot, quest_text, reward_hp, reward_bronze, reward_silver, reward_gold) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+log = logging.getLogger(__name__)
+
+
+# ==================== ГЕНЕРАЦИЯ ====================
+def quest_rows(user_id, day):
+    selected = random.sample(QUESTS, QUESTS_PER_DAY)
+    return [
+        (user_id, day, slot, quest_text, hp, b, s, g)
+        for slot, (quest_text, hp, b, s, g) in enumerate(selected)
+    ]
+
+
+async def generate_for_users(user_ids, day):
+    # Пакетами, чтобы одна операция не держала писателя слишком долго.
+    # INSERT OR IGNORE по ключу (user_id, date, slot) делает генерацию
+    # идемпотентной: повторный запуск не трогает уже созданные квесты.
+    for i in range(0, len(user_ids), QUEST_BATCH_USERS):
+        rows = []
+        for user_id in user_ids[i:i + QUEST_BATCH_USERS]:
+            rows += quest_rows(user_id, day)
+        await db.executemany(INSERT_QUEST, rows)
+
+
+async def active_users(day, zone=None):
+    # Активность — users.last_daily (последний день с выполненной целью или
+    # квестом, см. daily.touch_streak), а не наличие строк daily_quests:
+    # их создаёт сама смена дня, и один раз открывший квесты получал бы
+    # новые каждый день бессрочно. zone — только пользователи этого пояса.
+    since = (datetime.fromisoformat(day) - timedelta(days=QUEST_ACTIVE_DAYS)).date().isoformat()
+    if zone is None:
+        rows = await db.fetchall(
+            "SELECT user_id FROM users WHERE last_daily >= ?",
+            (since,)
+        )
+    else:
+        rows = await db.fetchall(
+            "SELECT user_id FROM users WHERE last_daily >= ? AND COALESCE(tz, ?) = ?",
+            (since, DEFAULT_TZ, zone)
+        )
+    return [row[0] for row in rows]
+
+
+# ==================== ХРАНЕНИЕ ====================
+async def purge_old_quests(day):
+    cutoff = (datetime.fromisoformat(day) - timedelta(days=QUEST_RETENTION_DAYS)).date().isoformat()
+
+    async def op(conn):
+        if QUEST_ARCHIVE:
+            await conn.execute(
+                "INSERT OR IGNORE INTO daily_quests_archive SELECT * FROM daily_quests WHERE date < ?",
+                (cutoff,)
+            )
+        cursor = await conn.execute("DELETE FROM daily_quests WHERE date < ?", (cutoff,))
+        return cursor.rowcount
+
+    return await db.run(op)
+
+
+# ==================== СМЕНА ДНЯ ====================
+async def rollover(day, zone=None):
+    # Вызывается из daily.end_of_day в полночь каждого пояса
+    users = await active_users(day, zone)
+    await generate_for_users(users, day)
+    purged = await purge_old_quests(day)
+    log.info("Квесты на %s (%s): сгенерировано для %d пользователей, удалено старых: %d",
+             day, zone or "все пояса", len(users), purged)
@@ -0,0 +1,201 @@
+import asyncio
+import heapq
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from clock import DEFAULT_TZ, get_zone
+from db import db
+
+# ========== НАСТРОЙКИ ==========
+# Пропущенное (бот лежал) напоминание досылается, если опоздание не больше этого
+REMINDER_GRACE = timedelta(minutes=int(os.getenv("REMINDER_GRACE_MINUTES", "60")))
+
+WEEKDAYS = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+EVERY_DAY = 0b1111111
+
+log = logging.getLogger(__name__)
+
+
+def weekdays_text(mask):
+    if mask == EVERY_DAY:
+        return "каждый день"
+    return ",".join(day for i, day in enumerate(WEEKDAYS) if mask & (1 << i))
+
+
+def parse_weekdays(text):
+    # "пн,ср,пт" -> битовая маска (пн = бит 0); None, если не разобрали
+    mask = 0
+    for part in text.lower().split(","):
+        part = part.strip()
+        if part not in WEEKDAYS:
+            return None
+        mask |= 1 << WEEKDAYS.index(part)
+    return mask
+
+
+# ==================== ПРАВИЛА ====================
+@dataclass
+class Reminder:
+    id: int
+    user_id: int
+    hour: int
+    minute: int
+    weekdays: int
+    text: str
+    tz: str
+    last_fired: datetime = None
+    version: int = 0
+
+    def occurrence(self, day, zone):
+        local = datetime(day.year, day.month, day.day, self.hour, self.minute, tzinfo=zone)
+        return local.astimezone(timezone.utc)
+
+    def next_fire(self, after):
+        # Ближайшее срабатывание строго после after (UTC)
+        zone = get_zone(self.tz)
+        day = after.astimezone(zone).date()
+        for _ in range(8):
+            if self.weekdays & (1 << day.weekday()):
+                at = self.occurrence(day, zone)
+                if at > after:
+                    return at
+            day += timedelta(days=1)
+        return None
+
+    def prev_fire(self, before):
+        # Последнее плановое срабатывание не позже before (UTC)
+        zone = get_zone(self.tz)
+        day = before.astimezone(zone).date()
+        for _ in range(8):
+            if self.weekdays & (1 << day.weekday()):
+                at = self.occurrence(day, zone)
+                if at <= before:
+                    return at
+            day -= timedelta(days=1)
+        return None
+
+
+# ==================== ПЛАНИРОВЩИК ====================
+class ReminderScheduler:
+    # Минимальная куча (время срабатывания, id, версия): цикл спит ровно до
+    # ближайшего события. Изменённые и удалённые правила не вынимаются из
+    # кучи — их записи просто отбрасываются по несовпадению версии.
+
+    def __init__(self, send, database=db):
+        self.send = send
+        self.db = database
+        # (номер, всего): при шардировании каждый процесс ведёт только
+        # напоминания своих пользователей
+        self.shard = None
+        self._rules = {}
+        self._heap = []
+        self._wakeup = asyncio.Event()
+
+    def _now(self):
+        return datetime.now(timezone.utc)
+
+    def _push(self, rule, at):
+        if at is not None:
+            heapq.heappush(self._heap, (at, rule.id, rule.version))
+            self._wakeup.set()
+
+    def _schedule(self, rule, now, recover=False):
+        rule.version += 1
+        if recover:
+            due = rule.prev_fire(now)
+            missed = due is not None and (rule.last_fired is None or rule.last_fired < due)
+            if missed and now - due <= REMINDER_GRACE:
+                self._push(rule, now)
+                return
+        self._push(rule, rule.next_fire(now))
+
+    async def _fetch(self, where="", params=()):
+        rows = await self.db.fetchall(
+            "SELECT r.id, r.user_id, r.hour, r.minute, r.weekdays, r.text, COALESCE(u.tz, ?), r.last_fired "
+            "FROM reminders r LEFT JOIN users u ON u.user_id = r.user_id "
+            f"WHERE r.enabled = 1 {where}",
+            (DEFAULT_TZ, *params)
+        )
+        rules = []
+        for rid, user_id, hour, minute, weekdays, text, tz, last_fired in rows:
+            last_fired = datetime.fromisoformat(last_fired) if last_fired else None
+            rules.append(Reminder(rid, user_id, hour, minute, weekdays, text, tz, last_fired))
+        return rules
+
+    async def load(self):
+        now = self._now()
+        for rule in await self._fetch():
+            if self.shard and rule.user_id % self.shard[1] != self.shard[0]:
+                continue
+            self._rules[rule.id] = rule
+            self._schedule(rule, now, recover=True)
+        log.info("Загружено напоминаний: %d", len(self._rules))
+
+    # ---------- изменения правил ----------
+    async def add(self, user_id, hour, minute, weekdays, text):
+        rid = await self.db.run(lambda conn: self._insert(conn, user_id, hour, minute, weekdays, text))
+        for rule in await self._fetch("AND r.id = ?", (rid,)):
+            self._rules[rule.id] = rule
+            self._schedule(rule, self._now())
+        return rid
+
+    async def _insert(self, conn, user_id, hour, minute, weekdays, text):
+        cursor = await conn.execute(
+            "INSERT INTO reminders (user_id, hour, minute, weekdays, text) VALUES (?, ?, ?, ?, ?)",
+            (user_id, hour, minute, weekdays, text)
+        )
+        return cursor.lastrowid
+
+    async def remove(self, user_id, rid):
+        removed = await self.db.execute("DELETE FROM reminders WHERE id = ? AND user_id = ?", (rid, user_id))
+        if removed:
+            self._rules.pop(rid, None)
+        return bool(removed)
+
+    def for_user(self, user_id):
+        rules = [r for r in self._rules.values() if r.user_id == user_id]
+        return sorted(rules, key=lambda r: (r.hour, r.minute, r.id))
+
+    def set_timezone(self, user_id, tz):
+        now = self._now()
+        for rule in self.for_user(user_id):
+            rule.tz = tz
+            self._schedule(rule, now)
+
+    # ---------- цикл ----------
+    async def run(self):
+        await self.load()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            at, rid, version = self._heap[0]
+            delay = (at - self._now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            rule = self._rules.get(rid)
+            if rule is None or rule.version != version:
+                continue
+            await self._fire(rule)
+            self._push(rule, rule.next_fire(max(at, rule.last_fired)))
+
+    async def _fire(self, rule):
+        rule.last_fired = self._now()
+        try:
+            await self.send(rule.user_id, rule.text)
+        except Exception:
+            log.exception("Не удалось отправить напоминание %d", rule.id)
+        await self.db.execute(
+            "UPDATE reminders SET last_fired = ? WHERE id = ?",
+            (rule.last_fired.isoformat(), rule.id)
+        )
@@ -0,0 +1,341 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+# ========== НАСТРОЙКИ ==========
+# Лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду в личный
+# чат (допускаются короткие всплески) и 20 в минуту в группу
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", "5"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "50"))
+TEXT_LIMIT = 4096
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# Приоритет исходящих запросов текущей задачи: ответы в хендлерах идут по
+# умолчанию как интерактивные, рассылки выставляют PRIORITY_BULK
+send_priority = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+log = logging.getLogger(__name__)
+
+
+# ==================== ВЕДРО ТОКЕНОВ ====================
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        # Сколько секунд ждать до свободного токена
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+# ==================== ОГРАНИЧИТЕЛЬ ====================
+class RateLimiter:
+    # Глобальное ведро плюс ведро на каждый чат. Ожидающие запросы лежат в
+    # куче по (приоритет, порядок поступления); токен получает самый
+    # приоритетный запрос, чей чат уже готов. Глобальное ведро вмещает один
+    # токен, поэтому отправки равномерно разнесены и не превышают лимит ни
+    # в каком окне.
+
+    def __init__(self, rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 group_rate=SEND_GROUP_RATE, chat_burst=SEND_CHAT_BURST):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(rate)
+        self._chats = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._last_cleanup = time.monotonic()
+        self.granted = 0
+        self.wait_time = 0.0
+
+    def _chat(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id — группы и каналы
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def share(self, parts):
+        # Несколько процессов делят один лимит бота поровну
+        self._global.rate /= parts
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self, chat_id, priority=PRIORITY_INTERACTIVE):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), chat_id, future, time.monotonic()))
+        self._wakeup.set()
+        await future
+
+    def pause(self, chat_id, seconds):
+        now = time.monotonic()
+        if chat_id is None:
+            self._global.block(now, seconds)
+        else:
+            self._chat(chat_id).block(now, seconds)
+        self._wakeup.set()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sleep(self, timeout):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            self._cleanup(now)
+
+            ready = None
+            deferred = []
+            soonest = None
+            while self._waiters:
+                item = heapq.heappop(self._waiters)
+                if item[3].done():
+                    continue
+                wait = self._chat(item[2]).delay(now)
+                if wait <= 0:
+                    ready = item
+                    break
+                deferred.append(item)
+                soonest = wait if soonest is None else min(soonest, wait)
+            for item in deferred:
+                heapq.heappush(self._waiters, item)
+
+            if ready is None:
+                await self._sleep(soonest)
+                continue
+
+            wait = self._global.delay(now)
+            if wait > 0:
+                # Пока ждём глобальный токен, может прийти более срочный запрос
+                heapq.heappush(self._waiters, ready)
+                await self._sleep(wait)
+                continue
+
+            self._global.take(now)
+            self._chat(ready[2]).take(now)
+            self.granted += 1
+            self.wait_time += now - ready[4]
+            ready[3].set_result(None)
+
+    def _cleanup(self, now):
+        # Полные ведра без ожидающих ничем не отличаются от новых — выбрасываем
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        waiting = {item[2] for item in self._waiters}
+        for chat_id in [c for c, b in self._chats.items() if c not in waiting and b.is_idle(now)]:
+            del self._chats[chat_id]
+
+
+# ==================== MIDDLEWARE СЕССИИ ====================
+class RateLimitMiddleware(BaseRequestMiddleware):
+    # Через ограничитель идут все запросы с chat_id (отправка и правка
+    # сообщений); getUpdates, answerCallbackQuery и т.п. — напрямую.
+    # RetryAfter ставит чат на паузу и повторяет запрос после неё.
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        for attempt in range(1, SEND_MAX_ATTEMPTS + 1):
+            await self.limiter.acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.limiter.pause(chat_id, e.retry_after)
+                error = e
+            except (TelegramNetworkError, TelegramServerError) as e:
+                self.limiter.pause(chat_id, min(2 ** attempt, 30))
+                error = e
+            else:
+                self.sent += 1
+                return response
+            self.retried += 1
+            log.warning("%s в чат %s, попытка %d: %s", type(method).__name__, chat_id, attempt, error)
+
+        self.failed += 1
+        raise error
+
+
+# ==================== РАССЫЛКА ====================
+class Broadcast:
+    # Прогресс одной рассылки
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.done}/{self.total} (ошибок: {self.failed}), "
+            f"{self.elapsed:.1f} с, {self.rate:.1f} сообщ./с"
+        )
+
+
+async def broadcast(bot, chat_ids, text, concurrency=BROADCAST_CONCURRENCY, **kwargs):
+    # Темп задаёт ограничитель в сессии бота; concurrency лишь держит
+    # достаточно запросов в полёте, чтобы задержка сети не срезала скорость
+    progress = Broadcast(len(chat_ids))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one(chat_id):
+        async with semaphore:
+            send_priority.set(PRIORITY_BULK)
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+            except Exception as e:
+                progress.failed += 1
+                log.info("Рассылка: не доставлено в %s: %s", chat_id, e)
+            else:
+                progress.sent += 1
+
+    await asyncio.gather(*(send_one(chat_id) for chat_id in chat_ids))
+    progress.finished = time.monotonic()
+    log.info("Рассылка завершена: %s", progress)
+    return progress
+
+
+def post(coro, priority=PRIORITY_BULK):
+    # Отправка вне критического пути: запрос уходит в очередь ограничителя,
+    # вызывающий не ждёт ответа Telegram
+    async def runner():
+        send_priority.set(priority)
+        try:
+            await coro
+        except Exception:
+            log.exception("Фоновая отправка не удалась")
+
+    task = asyncio.create_task(runner())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+_background = set()
+
+
+async def drain_posts(timeout=5.0):
+    # При остановке: дождаться фоновых отправок, пока ограничитель жив
+    if _background:
+        await asyncio.wait(set(_background), timeout=timeout)
+
+
+# ==================== ОТВЕТ НА НАЖАТИЕ ====================
+class CallbackReply:
+    # Хендлер копит части ответа, send() сразу отвечает на callback (это
+    # снимает «часики» с кнопки), а части склеивает в одну правку сообщения
+    # и отправляет её вне критического пути — повторы делает middleware
+    # сессии. Вместо «ответ + правка + новое сообщение» — два запроса.
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.parts = []
+        self.markdown = False
+
+    def add(self, text, markdown=False):
+        self.parts.append(text)
+        self.markdown = self.markdown or markdown
+        return self
+
+    def _chunks(self):
+        chunks = [""]
+        for part in self.parts:
+            joined = f"{chunks[-1]}\n\n{part}" if chunks[-1] else part
+            if len(joined) <= TEXT_LIMIT:
+                chunks[-1] = joined
+            else:
+                chunks.append(part)
+        return chunks
+
+    async def send(self, notice=None):
+        await self.callback.answer(notice)
+        if self.parts:
+            return post(self._deliver(self._chunks()), priority=PRIORITY_INTERACTIVE)
+
+    async def _deliver(self, chunks):
+        message = self.callback.message
+        parse_mode = "Markdown" if self.markdown else None
+        try:
+            await message.edit_text(chunks[0], parse_mode=parse_mode)
+        except TelegramBadRequest as e:
+            # Сообщение слишком старое или удалено — шлём новым
+            log.info("Правка не удалась (%s), отправляем новым сообщением", e)
+            chunks = chunks[:]
+        else:
+            chunks = chunks[1:]
+        for chunk in chunks:
+            await message.answer(chunk, parse_mode=parse_mode)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+
+from webhook import run_webhook
+
+# ========== НАСТРОЙКИ ==========
+# Число процессов-обработчиков; 1 — всё в одном процессе, как раньше
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "30"))
+POLLING_TIMEOUT = 30
+
+log = logging.getLogger(__name__)
+
+
+# ==================== МАРШРУТИЗАЦИЯ ====================
+def update_user_id(update):
+    # update — «сырой» dict от Telegram: {"update_id": ..., "message": {...}}
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+
+def shard_of(user_id, count):
+    return user_id % count
+
+
+# ==================== ПРОЦЕСС-ОБРАБОТЧИК ====================
+class OrderedFeeder:
+    # Обновления разных пользователей обрабатываются параллельно, одного —
+    # строго по очереди: каждое ждёт завершения предыдущего того же user_id
+
+    def __init__(self, dp, bot):
+        self.dp = dp
+        self.bot = bot
+        self._tails = {}
+
+    def submit(self, update):
+        user_id = update_user_id(update)
+        task = asyncio.create_task(self._feed(self._tails.get(user_id), update))
+        self._tails[user_id] = task
+        task.add_done_callback(lambda t: self._release(user_id, t))
+
+    def _release(self, user_id, task):
+        if self._tails.get(user_id) is task:
+            del self._tails[user_id]
+
+    async def _feed(self, previous, update):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception:
+            log.exception("Ошибка при обработке обновления %s", update.get("update_id"))
+
+    async def drain(self):
+        while self._tails:
+            await asyncio.gather(*self._tails.values(), return_exceptions=True)
+
+
+async def consume(queue, feeder):
+    # Читаем очередь процесса до None, затем дорабатываем начатое
+    loop = asyncio.get_running_loop()
+    while True:
+        update = await loop.run_in_executor(None, queue.get)
+        if update is None:
+            break
+        feeder.submit(update)
+    await feeder.drain()
+
+
+def ignore_interrupts():
+    # Ctrl+C приходит всей группе процессов; обработчики останавливает
+    # фронт — через None в очереди, после того как перестал принимать обновления.
+    # Поэтому terminate() на них не действует: зависший добивается kill()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+# ==================== ПУЛ ОБРАБОТЧИКОВ ====================
+class WorkerPool:
+    def __init__(self, target, count):
+        self.target = target
+        self.count = count
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue() for _ in range(count)]
+        self.processes = [None] * count
+        self.routed = [0] * count
+        self.restarts = 0
+        self._stopping = False
+
+    def _start(self, index):
+        process = self._ctx.Process(
+            target=self.target,
+            args=(index, self.count, self.queues[index]),
+            name=f"worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.count):
+            self._start(index)
+        log.info("Запущено обработчиков: %d", self.count)
+
+    def route(self, update):
+        index = shard_of(update_user_id(update), self.count)
+        self.queues[index].put(update)
+        self.routed[index] += 1
+
+    async def supervise(self):
+        # Упавший обработчик перезапускается с той же очередью — его
+        # пользователи не теряют ещё не обработанные обновления
+        while not self._stopping:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self.processes):
+                if not self._stopping and not process.is_alive():
+                    log.error("Обработчик %d завершился (код %s), перезапуск", index, process.exitcode)
+                    self.restarts += 1
+                    self._start(index)
+
+    async def stop(self, timeout=WORKER_STOP_TIMEOUT):
+        self._stopping = True
+        for queue in self.queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                # Иначе фронт повиснет при выходе: multiprocessing ждёт всех
+                # не-daemon потомков
+                log.warning("%s не завершился за %.0f с, принудительная остановка", process.name, timeout)
+                process.kill()
+                await loop.run_in_executor(None, process.join)
+
+
+# ==================== ФРОНТ ====================
+async def poll_updates(dp, bot, route):
+    offset = None
+    allowed_updates = dp.resolve_used_update_types()
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
+            except Exception:
+                log.exception("Ошибка getUpdates")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+    finally:
+        # Подтверждаем уже разосланные обновления, иначе после рестарта
+        # Telegram пришлёт их повторно
+        if offset is not None:
+            try:
+                await bot.get_updates(offset=offset, timeout=0, limit=1)
+            except Exception:
+                log.exception("Не удалось подтвердить offset %s", offset)
+
+
+async def run_polling_until_stopped(dp, bot, route):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    polling = asyncio.create_task(poll_updates(dp, bot, route))
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+
+
+async def run_front(dp, bot, target, count, mode="polling", checks=()):
+    # Фронт только принимает обновления и раскладывает их по процессам
+    # по user_id; хендлеры dp выполняются внутри обработчиков (target)
+    pool = WorkerPool(target, count)
+    pool.start()
+    supervisor = asyncio.create_task(pool.supervise())
+    try:
+        if mode == "webhook":
+            await run_webhook(dp, bot, checks=checks, route=pool.route)
+        else:
+            await run_polling_until_stopped(dp, bot, pool.route)
+    finally:
+        supervisor.cancel()
+        await asyncio.gather(supervisor, return_exceptions=True)
+        await pool.stop()
+        log.info("Обработчики остановлены, разослано обновлений: %s", pool.routed)
@@ -0,0 +1,53 @@
+from datetime import date, timedelta
+
+from db import db
+
+# ==================== ДНЕВНЫЕ СВОДКИ ====================
+# daily_stats — по строке на пользователя и день, ключ (user_id, day).
+# Сводка пополняется в той же операции записи, что и начисление, поэтому
+# экраны статистики читают только её: неделя — 7 строк, месяц — ~30.
+
+DIFFICULTY_COLUMNS = {1: "tasks_easy", 2: "tasks_medium", 3: "tasks_hard"}
+
+
+async def add_daily(conn, user_id, day, reward, earned=(), difficulty=None, quests=0):
+    # reward — (hp, бронза, серебро, золото) за действие; earned — выданные
+    # вместе с ним достижения, их награды тоже считаются заработанными
+    hp, bronze, silver, gold = reward
+    for a in earned:
+        hp, bronze, silver, gold = hp + a.hp, bronze + a.bronze, silver + a.silver, gold + a.gold
+    tasks = [0, 0, 0]
+    if difficulty is not None:
+        tasks[min(max(difficulty, 1), 3) - 1] = 1
+    await conn.execute(
+        "INSERT INTO daily_stats (user_id, day, tasks_easy, tasks_medium, tasks_hard, quests, hp, bronze, silver, gold) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id, day) DO UPDATE SET "
+        "tasks_easy = tasks_easy + excluded.tasks_easy, tasks_medium = tasks_medium + excluded.tasks_medium, "
+        "tasks_hard = tasks_hard + excluded.tasks_hard, quests = quests + excluded.quests, "
+        "hp = hp + excluded.hp, bronze = bronze + excluded.bronze, "
+        "silver = silver + excluded.silver, gold = gold + excluded.gold",
+        (user_id, day, *tasks, quests, hp, bronze, silver, gold)
+    )
+
+
+async def daily_range(user_id, first, last, database=db):
+    # {день: (лёгкие, средние, сложные, квесты, hp, бронза, серебро, золото)}
+    rows = await database.fetchall(
+        "SELECT day, tasks_easy, tasks_medium, tasks_hard, quests, hp, bronze, silver, gold "
+        "FROM daily_stats WHERE user_id = ? AND day BETWEEN ? AND ?",
+        (user_id, first.isoformat(), last.isoformat())
+    )
+    return {row[0]: row[1:] for row in rows}
+
+
+async def monthly(user_id, months, today, database=db):
+    # Итоги по месяцам — та же выборка по ключу, сгруппированная в SQL
+    first = date(today.year, today.month, 1)
+    for _ in range(months - 1):
+        first = (first - timedelta(days=1)).replace(day=1)
+    return await database.fetchall(
+        "SELECT substr(day, 1, 7), SUM(tasks_easy + tasks_medium + tasks_hard), SUM(quests), SUM(hp) "
+        "FROM daily_stats WHERE user_id = ? AND day >= ? GROUP BY 1 ORDER BY 1",
+        (user_id, first.isoformat())
+    )
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+from db import db
+
+# ========== НАСТРОЙКИ ==========
+# Сколько ключей держать в памяти и сколько секунд простоя до вытеснения
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "600"))
+# Состояния, не менявшиеся дольше этого, удаляются и из базы
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_PURGE_INTERVAL = 3600
+
+log = logging.getLogger(__name__)
+
+
+def key_id(key):
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+    ))
+
+
+class Record:
+    __slots__ = ("state", "data", "updated", "touched")
+
+    def __init__(self, state=None, data=None, updated=0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated = updated
+        self.touched = time.monotonic()
+
+    @property
+    def is_empty(self):
+        return self.state is None and not self.data
+
+
+# ==================== ХРАНИЛИЩЕ FSM ====================
+class SQLiteStorage(BaseStorage):
+    # Горячие ключи живут в памяти, изменения копятся в _dirty и раз в
+    # FSM_FLUSH_INTERVAL пишутся в fsm одной операцией. Кэш в памяти
+    # корректен, пока все обновления пользователя обрабатывает один процесс
+    # (см. шардирование по user_id); сам файл базы общий для всех процессов.
+
+    def __init__(self, database=db):
+        self.db = database
+        self._records = OrderedDict()
+        self._dirty = set()
+        self._loading = {}
+        self._flusher = None
+        self.hits = 0
+        self.misses = 0
+
+    async def _record(self, key):
+        kid = key_id(key)
+        record = self._records.get(kid)
+        if record is not None:
+            self._records.move_to_end(kid)
+            record.touched = time.monotonic()
+            self.hits += 1
+            return kid, record
+
+        self.misses += 1
+        task = self._loading.get(kid)
+        if task is None:
+            task = asyncio.ensure_future(self._load(kid))
+            self._loading[kid] = task
+            task.add_done_callback(lambda _: self._loading.pop(kid, None))
+        return kid, await asyncio.shield(task)
+
+    async def _load(self, kid):
+        row = await self.db.fetchone("SELECT state, data, updated_at FROM fsm WHERE key = ?", (kid,))
+        # Пока читали, ключ мог быть записан — запись в памяти новее
+        record = self._records.get(kid)
+        if record is None:
+            if row and time.time() - row[2] <= FSM_STATE_TTL:
+                record = Record(row[0], json.loads(row[1]) if row[1] else {}, row[2])
+            else:
+                record = Record()
+            self._put(kid, record)
+        return record
+
+    def _put(self, kid, record):
+        self._records[kid] = record
+        self._records.move_to_end(kid)
+        self._evict()
+
+    def _evict(self):
+        # Вытесняем только сохранённые записи: грязные дождутся сброса
+        now = time.monotonic()
+        for kid in list(self._records):
+            record = self._records[kid]
+            if len(self._records) <= FSM_CACHE_SIZE and now - record.touched < FSM_CACHE_TTL:
+                break
+            if kid not in self._dirty:
+                del self._records[kid]
+
+    def _changed(self, kid, record):
+        record.updated = time.time()
+        self._dirty.add(kid)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    # ---------- BaseStorage ----------
+    async def set_state(self, key, state=None):
+        kid, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._changed(kid, record)
+
+    async def get_state(self, key):
+        _, record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        kid, record = await self._record(key)
+        record.data = data.copy()
+        self._changed(kid, record)
+
+    async def get_data(self, key):
+        _, record = await self._record(key)
+        return record.data.copy()
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    # ---------- сброс в базу ----------
+    async def _flush_loop(self):
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(FSM_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if time.monotonic() - last_purge >= FSM_PURGE_INTERVAL:
+                    last_purge = time.monotonic()
+                    await self.purge_expired()
+            except Exception:
+                log.exception("Не удалось сохранить состояния FSM")
+            self._evict()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        upserts = []
+        deletes = []
+        for kid in self._dirty:
+            record = self._records[kid]
+            if record.is_empty:
+                deletes.append((kid,))
+            else:
+                upserts.append((kid, record.state, json.dumps(record.data, ensure_ascii=False), record.updated))
+        self._dirty.clear()
+
+        async def op(conn):
+            if upserts:
+                await conn.executemany(
+                    "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                    upserts
+                )
+            if deletes:
+                await conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+        try:
+            await self.db.run(op)
+        except BaseException:
+            # Не потеряли: вернём ключи в очередь на следующий сброс — и при
+            # отмене из close(), чей последний flush() их и запишет
+            self._dirty.update(row[0] for row in upserts + deletes)
+            raise
+
+    async def purge_expired(self):
+        cutoff = time.time() - FSM_STATE_TTL
+        return await self.db.execute("DELETE FROM fsm WHERE updated_at < ?", (cutoff,))
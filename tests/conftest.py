@@ -0,0 +1,74 @@
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# Настройки модулей бота читаются при импорте — окружение готовим до него
+_workdir = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = os.path.join(_workdir.name, "test.db")
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("METRICS_PORT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from aiogram import types
+
+
+@pytest.fixture
+def run_bot():
+    # run_bot(scenario): scenario(app) выполняется в одном цикле событий с
+    # открытой свежей базой; Telegram подменён поддельной сессией
+    import bot as app
+    from bench import FakeSession, Stats
+    from migrations import migrate
+    from sender import RateLimiter
+
+    session = FakeSession(Stats())
+    session.middleware = app.bot.session.middleware
+    original = app.bot.session
+    app.bot.session = session
+
+    async def main(scenario):
+        # Ограничитель отправки привязан к циклу событий — на каждый прогон
+        # свой, и без лимитов Telegram — здесь проверяется не отправка
+        limiter = RateLimiter(rate=1e6, chat_rate=1e6, chat_burst=1000)
+        app.rate_limit.limiter = limiter
+        if os.path.exists(app.db.path):
+            os.remove(app.db.path)
+        await app.db.open()
+        try:
+            await migrate()
+            return await scenario(app)
+        finally:
+            await limiter.close()
+            await app.dp.storage.close()
+            await app.db.close()
+
+    yield lambda scenario: asyncio.run(main(scenario))
+    app.bot.session = original
+
+
+@pytest.fixture
+def message():
+    # message(user_id, update_id, text) — обновление с текстом из личного чата
+    def make(user_id, update_id, text):
+        user = types.User(id=user_id, is_bot=False, first_name="test")
+        chat = types.Chat(id=user_id, type="private")
+        return types.Update(update_id=update_id, message=types.Message(
+            message_id=update_id, date=datetime.now(), chat=chat, from_user=user, text=text,
+        ))
+    return make
+
+
+@pytest.fixture
+def callback():
+    # callback(user_id, update_id, data) — нажатие инлайн-кнопки под сообщением бота
+    def make(user_id, update_id, data):
+        user = types.User(id=user_id, is_bot=False, first_name="test")
+        chat = types.Chat(id=user_id, type="private")
+        return types.Update(update_id=update_id, callback_query=types.CallbackQuery(
+            id=str(update_id), chat_instance=str(user_id), from_user=user, data=data,
+            message=types.Message(message_id=update_id, date=datetime.now(), chat=chat, text="…"),
+        ))
+    return make
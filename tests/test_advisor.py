@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from advisor import load_profile
+
+
+def test_goal_age_uses_user_day(run_bot):
+    # Пояса на обоих краях суток: в любой момент хотя бы у одного из них
+    # дата отличается от даты сервера
+    zones = {81: "Pacific/Kiritimati", 82: "Pacific/Pago_Pago"}
+
+    async def scenario(app):
+        result = {}
+        for user_id, zone in zones.items():
+            await app.db.execute("INSERT INTO users (user_id, tz) VALUES (?, ?)", (user_id, zone))
+            app.clock.set_zone(user_id, zone)
+            await app.create_goal(user_id, "Пробежка", 2)
+            today = app.clock.today(user_id)
+            profile = await load_profile(user_id, today)
+            stamp = await app.db.fetchone("SELECT created_at FROM tasks WHERE user_id = ?", (user_id,))
+            result[user_id] = today, profile.oldest_goal[1], datetime.fromisoformat(stamp[0]).tzinfo
+        return result
+
+    for today, created, tzinfo in run_bot(scenario).values():
+        assert created == today
+        assert tzinfo is not None
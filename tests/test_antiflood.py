@@ -0,0 +1,18 @@
+import asyncio
+
+
+def test_flood_is_dropped_before_state_is_read(run_bot, message):
+    # Сверх всплеска обновления отбрасываются до FSM-middleware: хранилище
+    # состояний читается только для пропущенных
+    async def scenario(app):
+        storage = app.dp.storage
+        reads = storage.hits + storage.misses
+        total = app.anti_flood.burst + 4
+        await asyncio.gather(*(
+            app.dp.feed_update(app.bot, message(77, 100 + i, "🎮 Игра")) for i in range(total)
+        ))
+        return total, storage.hits + storage.misses - reads, app.anti_flood.dropped["rate"]
+
+    total, reads, dropped = run_bot(scenario)
+    assert dropped == 4
+    assert reads == total - dropped
@@ -0,0 +1,26 @@
+from aiogram.fsm.storage.base import StorageKey
+
+
+def test_command_in_title_step_is_not_a_goal(run_bot, message):
+    async def scenario(app):
+        await app.dp.feed_update(app.bot, message(51, 1, "➕ Добавить цель"))
+        await app.dp.feed_update(app.bot, message(51, 2, "/tz Europe/Moscow"))
+        tasks = await app.db.fetchall("SELECT title FROM tasks WHERE user_id = 51")
+        tz = await app.db.fetchone("SELECT tz FROM users WHERE user_id = 51")
+        key = StorageKey(bot_id=app.bot.id, chat_id=51, user_id=51)
+        return tasks, tz, await app.dp.storage.get_state(key)
+
+    tasks, tz, state = run_bot(scenario)
+    assert tasks == []
+    assert tz == ("Europe/Moscow",)
+    assert state == "AddGoal:title"
+
+
+def test_stale_difficulty_button_is_answered(run_bot, callback):
+    async def scenario(app):
+        calls = app.bot.session.stats.api_calls
+        before = calls["AnswerCallbackQuery"]
+        await app.dp.feed_update(app.bot, callback(52, 1, "goal_diff_2"))
+        return calls["AnswerCallbackQuery"] - before
+
+    assert run_bot(scenario) == 1
@@ -0,0 +1,33 @@
+import io
+import json
+
+from maintenance import (
+    EXPORT_USER_ROWS, EXPORT_USERS_PAGE, IMPORT_DELETE_USER_ROWS, USER_TABLES, export_jsonl,
+)
+
+
+def test_export_pages_by_primary_key(run_bot):
+    async def scenario(app):
+        await app.db.execute("INSERT INTO users (user_id, name) VALUES (5, 'a'), (-3, 'b'), (9, 'c'), (2, 'd'), (7, 'e')")
+        await app.db.execute("INSERT INTO tasks (user_id, title, difficulty) VALUES (9, 'x', '1')")
+        out = io.StringIO()
+        count = await export_jsonl(out, batch=2)
+        queries = [(EXPORT_USERS_PAGE, (0, 2))]
+        for table in USER_TABLES:
+            queries.append((EXPORT_USER_ROWS.format(table=table, placeholders="?, ?"), (5, 9)))
+            queries.append((IMPORT_DELETE_USER_ROWS.format(table=table), (5,)))
+        plans = {}
+        for sql, params in queries:
+            plan = await app.db.fetchall("EXPLAIN QUERY PLAN " + sql, params)
+            plans[sql] = " ".join(row[-1] for row in plan)
+        return count, out.getvalue().splitlines(), plans
+
+    count, lines, plans = run_bot(scenario)
+    records = [json.loads(line) for line in lines]
+    ids = [record["user"]["user_id"] for record in records]
+    # Плюс администратор, которого создают миграции
+    assert count == len(ids) == 6
+    assert ids == sorted(ids) and ids[:5] == [-3, 2, 5, 7, 9]
+    assert records[4]["tasks"][0]["title"] == "x"
+    # Каждая пачка и каждый пользователь ищутся по индексу, без скана таблиц
+    assert {sql: plan for sql, plan in plans.items() if "SCAN" in plan} == {}
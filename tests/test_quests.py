@@ -0,0 +1,17 @@
+from quests import active_users, generate_for_users, rollover
+
+
+def test_rollover_does_not_keep_idle_users_active(run_bot):
+    # Пользователь, который лишь открыл квесты, не становится «активным»
+    # от строк, созданных самой сменой дня
+    async def scenario(app):
+        await app.db.execute("INSERT INTO users (user_id, last_daily) VALUES (1, '2026-03-01'), (2, NULL)")
+        await generate_for_users([1, 2], "2026-03-01")
+        for day in ("2026-03-02", "2026-03-03", "2026-03-04"):
+            await rollover(day)
+        rows = await app.db.fetchall("SELECT user_id, COUNT(*) FROM daily_quests GROUP BY user_id ORDER BY user_id")
+        return rows, await active_users("2026-03-20")
+
+    rows, later = run_bot(scenario)
+    assert rows == [(1, 12), (2, 3)]
+    assert later == []
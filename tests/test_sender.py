@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from bench import FakeSession, Stats
+from sender import (
+    PRIORITY_BULK, SEND_GLOBAL_RATE, RateLimiter, RateLimitMiddleware, send_priority,
+)
+
+
+class RecordingSession(FakeSession):
+    # Поддельный Bot API: запоминает момент каждого запроса и по заказу
+    # отвечает на первые попытки в чат ошибкой RetryAfter
+    def __init__(self, flood=None):
+        super().__init__(Stats())
+        self.sent = []
+        self.flood = dict(flood or {})
+
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = method.chat_id
+        self.sent.append((time.monotonic(), chat_id, method.text))
+        if self.flood.get(chat_id):
+            self.flood[chat_id] -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        return await super().make_request(bot, method, timeout)
+
+
+def make_bot(limiter, flood=None):
+    session = RecordingSession(flood)
+    middleware = RateLimitMiddleware(limiter)
+    session.middleware(middleware)
+    return Bot(token="123456:TEST", session=session), session, middleware
+
+
+def max_in_window(times, window=1.0):
+    times = sorted(times)
+    return max(sum(1 for t in times[i:] if t < start + window) for i, start in enumerate(times))
+
+
+def test_global_rate_is_never_exceeded():
+    # Вдвое больше сообщений, чем лимит, в разные чаты: ни в одном
+    # секундном окне отправок не больше SEND_GLOBAL_RATE
+    async def scenario():
+        limiter = RateLimiter(rate=SEND_GLOBAL_RATE, chat_rate=1000, chat_burst=1000)
+        bot, session, _ = make_bot(limiter)
+        total = int(SEND_GLOBAL_RATE * 2)
+        try:
+            await asyncio.gather(*(bot.send_message(chat, "x") for chat in range(1, total + 1)))
+        finally:
+            await limiter.close()
+        return total, [t for t, _, _ in session.sent]
+
+    total, times = asyncio.run(scenario())
+    assert len(times) == total
+    assert max_in_window(times) <= SEND_GLOBAL_RATE
+
+
+def test_chat_burst_then_chat_rate():
+    # В один чат: сначала всплеск chat_burst, дальше — не чаще chat_rate
+    async def scenario():
+        limiter = RateLimiter(rate=1000, chat_rate=5, chat_burst=3)
+        bot, session, _ = make_bot(limiter)
+        started = time.monotonic()
+        try:
+            await asyncio.gather(*(bot.send_message(7, str(i)) for i in range(6)))
+        finally:
+            await limiter.close()
+        return [t - started for t, _, _ in session.sent]
+
+    times = asyncio.run(scenario())
+    assert len(times) == 6
+    assert all(t < 0.1 for t in times[:3])
+    for previous, current in zip(times[2:], times[3:]):
+        assert current - previous >= 0.2 - 0.01
+
+
+def test_retry_after_pauses_chat_and_retries():
+    async def scenario():
+        limiter = RateLimiter(rate=1000, chat_rate=1000, chat_burst=10)
+        bot, session, middleware = make_bot(limiter, flood={9: 1})
+        try:
+            await bot.send_message(9, "x")
+        finally:
+            await limiter.close()
+        return session.sent, middleware
+
+    sent, middleware = asyncio.run(scenario())
+    assert len(sent) == 2
+    assert sent[1][0] - sent[0][0] >= 1.0 - 0.01
+    assert middleware.retried == 1 and middleware.sent == 1 and middleware.failed == 0
+
+
+def test_interactive_overtakes_bulk():
+    # Очередь рассылки уже стоит; ответ пользователю уходит следующим
+    async def scenario():
+        limiter = RateLimiter(rate=20, chat_rate=1000, chat_burst=1000)
+        bot, session, _ = make_bot(limiter)
+
+        async def bulk(chat):
+            send_priority.set(PRIORITY_BULK)
+            await bot.send_message(chat, "bulk")
+
+        try:
+            tasks = [asyncio.create_task(bulk(chat)) for chat in range(1, 11)]
+            await asyncio.sleep(0.12)
+            await bot.send_message(100, "interactive")
+            await asyncio.gather(*tasks)
+        finally:
+            await limiter.close()
+        return [text for _, _, text in session.sent]
+
+    order = asyncio.run(scenario())
+    position = order.index("interactive")
+    assert len(order) == 11
+    assert position <= 4
+    assert order[position + 1:] == ["bulk"] * (10 - position)
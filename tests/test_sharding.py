@@ -0,0 +1,22 @@
+import asyncio
+import signal
+import time
+
+from sharding import WorkerPool, ignore_interrupts
+
+
+def stuck_worker(index, count, queue):
+    # Обработчик, который не дочитывает очередь до None
+    ignore_interrupts()
+    time.sleep(60)
+
+
+def test_stop_kills_worker_that_missed_timeout():
+    pool = WorkerPool(stuck_worker, 1)
+    pool.start()
+    started = time.monotonic()
+    asyncio.run(pool.stop(timeout=0.5))
+    process = pool.processes[0]
+    assert time.monotonic() - started < 10
+    assert not process.is_alive()
+    assert process.exitcode == -signal.SIGKILL
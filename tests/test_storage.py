@@ -0,0 +1,22 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+import db
+import storage
+
+
+def test_close_during_flush_keeps_state(run_bot, monkeypatch):
+    # close() отменяет фоновый сброс, пока тот ждёт окна пакетной записи:
+    # состояние всё равно должно попасть в базу
+    monkeypatch.setattr(storage, "FSM_FLUSH_INTERVAL", 0.05)
+    monkeypatch.setattr(db, "DB_BATCH_WINDOW_MS", 50)
+
+    async def scenario(app):
+        key = StorageKey(bot_id=app.bot.id, chat_id=61, user_id=61)
+        await app.dp.storage.set_state(key, "AddGoal:title")
+        await asyncio.sleep(0.08)
+        await app.dp.storage.close()
+        return await app.db.fetchall("SELECT state FROM fsm WHERE key LIKE '%:61:61:%'")
+
+    assert run_bot(scenario) == [("AddGoal:title",)]
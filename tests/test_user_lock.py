@@ -0,0 +1,14 @@
+import asyncio
+
+
+def test_second_update_sees_state_set_by_first(run_bot, message):
+    # Два сообщения одного пользователя пришли разом: второе должно
+    # маршрутизироваться по состоянию, которое выставило первое
+    async def scenario(app):
+        await asyncio.gather(
+            app.dp.feed_update(app.bot, message(42, 1, "➕ Добавить цель")),
+            app.dp.feed_update(app.bot, message(42, 2, "Пробежка | 2")),
+        )
+        return await app.db.fetchall("SELECT title, difficulty FROM tasks WHERE user_id = 42")
+
+    assert run_bot(scenario) == [("Пробежка", "2")]
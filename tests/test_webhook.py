@@ -0,0 +1,47 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiohttp import ClientSession, ClientConnectionError, web
+
+from webhook import DrainingRequestHandler, health_view, stop_gracefully
+
+
+def test_stop_reports_draining_before_closing_sockets():
+    # Пока идёт пауза вывода из ротации, порт открыт: /healthz отвечает
+    # draining, новые обновления получают 503; после неё порт закрыт
+    async def scenario():
+        bot = Bot(token="123456:TEST")
+        handler = DrainingRequestHandler(Dispatcher(), bot, secret_token="s", handle_in_background=True)
+        app = web.Application()
+        handler.register(app, path="/webhook")
+        app.router.add_get("/healthz", health_view(handler))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = "http://127.0.0.1:%d" % runner.addresses[0][1]
+
+        async with ClientSession() as http:
+            async with http.get(url + "/healthz") as response:
+                before = response.status, (await response.json())["status"]
+            stopping = asyncio.create_task(stop_gracefully(handler, runner, grace=0.5))
+            await asyncio.sleep(0.1)
+            async with http.get(url + "/healthz") as response:
+                during = response.status, (await response.json())["status"]
+            async with http.post(url + "/webhook", json={"update_id": 1},
+                                 headers={"X-Telegram-Bot-Api-Secret-Token": "s"}) as response:
+                rejected = response.status
+            await stopping
+            try:
+                async with http.get(url + "/healthz"):
+                    closed = False
+            except ClientConnectionError:
+                closed = True
+        await bot.session.close()
+        return before, during, rejected, closed
+
+    before, during, rejected, closed = asyncio.run(scenario())
+    assert before == (200, "ok")
+    assert during == (503, "draining")
+    assert rejected == 503
+    assert closed
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import secrets
+import signal
+
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+# ========== НАСТРОЙКИ ==========
+# Публичный адрес, на который Telegram шлёт обновления (за балансировщиком)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Общий для всех экземпляров секрет; Telegram присылает его в заголовке
+# X-Telegram-Bot-Api-Secret-Token, запросы без него отклоняются
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+# Сколько секунд после сигнала остановки порт ещё открыт: /healthz отвечает
+# draining, балансировщик успевает убрать экземпляр из ротации
+WEBHOOK_DRAIN_GRACE = float(os.getenv("WEBHOOK_DRAIN_GRACE", "5"))
+
+log = logging.getLogger(__name__)
+
+
+# ==================== ОБРАБОТЧИК ====================
+class DrainingRequestHandler(SimpleRequestHandler):
+    # Отвечает Telegram сразу и обрабатывает обновление в фоне. При остановке
+    # (см. stop_gracefully) draining выставляется, пока сокеты ещё открыты:
+    # новые обновления получают 503 — Telegram повторит их на другом
+    # экземпляре, — а уже начатые дорабатываются.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.draining = False
+
+    @property
+    def in_flight(self):
+        return len(self._background_feed_update_tasks)
+
+    async def handle(self, request):
+        if self.draining:
+            return web.Response(status=503)
+        return await super().handle(request)
+
+    async def drain(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        self.draining = True
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        log.info("Дожидаемся %d обновлений в обработке", len(tasks))
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            log.warning("Не дождались %d обновлений за %.0f с", len(pending), timeout)
+
+    async def close(self):
+        await self.drain()
+        await super().close()
+
+
+class RoutingRequestHandler(DrainingRequestHandler):
+    # Для шардированного запуска: обновление не обрабатывается здесь,
+    # а передаётся в route (раскладка по процессам-обработчикам)
+
+    def __init__(self, route, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.route = route
+
+    async def _handle_request_background(self, bot, request):
+        self.route(await request.json(loads=bot.session.json_loads))
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+def health_view(handler, checks=()):
+    # checks — функции без аргументов, возвращающие True, если всё в порядке
+    async def health(request):
+        status = "draining" if handler.draining else "ok"
+        failed = [check.__name__ for check in checks if not check()]
+        if failed and status == "ok":
+            status = "unhealthy"
+        return web.json_response(
+            {"status": status, "in_flight": handler.in_flight, "failed": failed},
+            status=200 if status == "ok" else 503,
+        )
+    return health
+
+
+# ==================== ОСТАНОВКА ====================
+async def stop_gracefully(handler, runner, grace=WEBHOOK_DRAIN_GRACE):
+    # Сокеты закрываются только после паузы grace и дренажа; on_shutdown
+    # (закрытие сессии) вызывается из runner.cleanup()
+    handler.draining = True
+    log.info("Остановка: %.0f с на вывод из ротации", grace)
+    await asyncio.sleep(grace)
+    await handler.drain()
+    await runner.cleanup()
+
+
+# ==================== ЗАПУСК ====================
+async def run_webhook(dp, bot, checks=(), route=None):
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужен WEBHOOK_URL")
+
+    secret = WEBHOOK_SECRET
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        log.warning("WEBHOOK_SECRET не задан — сгенерирован случайный, несколько экземпляров так не запустить")
+
+    app = web.Application()
+    if route is None:
+        handler = DrainingRequestHandler(dp, bot, secret_token=secret, handle_in_background=True)
+    else:
+        handler = RoutingRequestHandler(route, dp, bot, secret_token=secret, handle_in_background=True)
+    handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", health_view(handler, checks))
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    log.info("Webhook слушает %s:%d%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        # Webhook не снимаем — его обслуживают и другие экземпляры
+        await stop_gracefully(handler, runner)